@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""cdxj_index.py
+
+Write and query CDXJ sidecar indexes for WARC/WARC.GZ files.
+
+For every `response` and `revisit` record one line is written to
+`<file>.cdxj` next to the WARC:
+
+    com,example)/page.html 20030501100000 {"url": ..., "mime": ..., "status": ...,
+                                            "digest": ..., "offset": ..., "length": ...,
+                                            "filename": ...}
+
+Lines are sorted by SURT key and timestamp, so a single URL can be found with
+a binary search over the index file. `offset` and `length` point at the
+record in the WARC; for per-record gzipped files that is exactly one gzip
+member, so a single record can be read without decompressing anything else.
+Revisit records get the MIME type `warc/revisit` and responses without a
+Content-Type get `unk`, as in pywb. Whitespace in the SURT key is
+percent-encoded, so the key, timestamp and JSON are always separated by the
+first two spaces of a line.
+
+Usage:
+    python cdxj_index.py build archive.warc.gz [more.warc.gz ...]
+    python cdxj_index.py count archive.warc.gz
+    python cdxj_index.py mime archive.warc.gz
+    python cdxj_index.py get archive.warc.gz https://example.com/ [--timestamp 2003]
+
+Notes:
+- `count`, `mime` and `get` only read the sidecar (and for `get`, the one
+  record it points at); the index must be built first.
+"""
+
+from __future__ import annotations
+import argparse
+import io
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from warc_scan import ArchiveIterator, ScannedRecord, WarcConsumer, get_mime_type, scan_warc
+
+INDEXED_TYPES = ('response', 'revisit')
+REVISIT_MIME = 'warc/revisit'
+# Responses without a Content-Type; not counted by `mime`, like MimeCounter
+UNKNOWN_MIME = 'unk'
+
+
+def _escape_whitespace(key: str) -> str:
+    # Index lines are split on spaces, so keys must not contain any
+    return re.sub(r'\s', lambda m: quote(m.group()), key)
+
+
+def surt_key(url: str) -> str:
+    """Return a SURT-style sort key for `url`, e.g. `com,example)/path?a=1`.
+
+    Whitespace is percent-encoded (`a b` -> `a%20b`).
+    """
+    try:
+        parts = urlsplit(url.strip())
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return _escape_whitespace(url.lower())
+    if not host:
+        return _escape_whitespace(url.lower())
+
+    if host.startswith('www.'):
+        host = host[4:]
+    key = ','.join(reversed(host.split('.')))
+    if port and not (parts.scheme, port) in (('http', 80), ('https', 443)):
+        key += f':{port}'
+
+    path = parts.path or '/'
+    key += ')' + path.lower()
+    if parts.query:
+        key += '?' + '&'.join(sorted(parts.query.lower().split('&')))
+    return _escape_whitespace(key)
+
+
+def warc_date_to_timestamp(warc_date: str) -> str:
+    """Convert a `WARC-Date` value to a 14-digit wayback timestamp."""
+    return re.sub(r'\D', '', warc_date or '')[:14]
+
+
+def sidecar_path(warc_path: str) -> str:
+    return warc_path + '.cdxj'
+
+
+class CdxjIndexer(WarcConsumer):
+    """Collect one CDXJ line per `response`/`revisit` record."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.lines: List[Tuple[str, str, str]] = []
+
+    def accepts(self, record) -> bool:
+        return record.rec_type in INDEXED_TYPES
+
+    def consume(self, item: ScannedRecord) -> None:
+        if item.error is not None:
+            return
+        record = item.record
+        url = record.rec_headers.get_header('WARC-Target-URI') or ''
+        digest = record.rec_headers.get_header('WARC-Payload-Digest') or ''
+        fields: Dict[str, str] = {'url': url}
+        if record.rec_type == 'revisit':
+            fields['mime'] = REVISIT_MIME
+        else:
+            fields['mime'] = get_mime_type(record) or UNKNOWN_MIME
+        if record.http_headers:
+            fields['status'] = record.http_headers.get_statuscode() or '-'
+        fields['digest'] = digest.split(':', 1)[-1]
+        fields['offset'] = str(item.offset)
+        fields['length'] = str(item.length)
+        fields['filename'] = self.filename
+
+        timestamp = warc_date_to_timestamp(record.rec_headers.get_header('WARC-Date'))
+        self.lines.append((surt_key(url), timestamp, json.dumps(fields)))
+
+    def finish(self) -> List[str]:
+        self.lines.sort()
+        return [' '.join(line) for line in self.lines]
+
+
+def build_index(warc_path: str, output_path: Optional[str] = None) -> str:
+    """Scan `warc_path` once and write its sorted CDXJ sidecar."""
+    output_path = output_path or sidecar_path(warc_path)
+    lines, = scan_warc(warc_path, [CdxjIndexer(os.path.basename(warc_path))])
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for line in lines:
+            out.write(line + '\n')
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def parse_line(line: str) -> Tuple[str, str, Dict[str, str]]:
+    key, timestamp, fields = line.rstrip('\n').split(' ', 2)
+    return key, timestamp, json.loads(fields)
+
+
+def read_index(cdxj_path: str) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """Yield `(surt_key, timestamp, fields)` for every line of an index."""
+    with open(cdxj_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield parse_line(line)
+
+
+def _line_start_at_or_after(f, pos: int) -> int:
+    """Seek to the first line that starts at or after `pos` and return its offset."""
+    if pos == 0:
+        f.seek(0)
+    else:
+        f.seek(pos - 1)
+        f.readline()
+    return f.tell()
+
+
+def bisect_index(f, key: str) -> int:
+    """Return the offset of the first line whose key is >= `key`.
+
+    `f` is a sorted index opened in binary mode; `key` may be a SURT prefix.
+    """
+    f.seek(0, io.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _line_start_at_or_after(f, mid)
+        line = f.readline()
+        if line and line.split(b' ', 1)[0].decode('utf-8') < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return _line_start_at_or_after(f, lo)
+
+
+def lookup(cdxj_path: str, url: str) -> List[Tuple[str, str, Dict[str, str]]]:
+    """Return all index entries for `url`, ordered by timestamp."""
+    key = surt_key(url)
+    matches = []
+    with open(cdxj_path, 'rb') as f:
+        f.seek(bisect_index(f, key))
+        for raw in f:
+            entry = parse_line(raw.decode('utf-8'))
+            if entry[0] != key:
+                break
+            matches.append(entry)
+    return matches
+
+
+def fetch_record(warc_path: str, offset: int, length: int):
+    """Read the single record at `offset` without scanning the rest of the file.
+
+    Returns the warcio record; its content stream is readable.
+    """
+    with open(warc_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return next(iter(ArchiveIterator(io.BytesIO(data))))
+
+
+def closest_entry(entries: list, timestamp: Optional[str]) -> Optional[tuple]:
+    """Pick the entry whose timestamp is closest to `timestamp` (latest if None)."""
+    if not entries:
+        return None
+    if not timestamp:
+        return entries[-1]
+    target = int(timestamp.ljust(14, '0')[:14])
+    return min(entries, key=lambda e: abs(int(e[1] or 0) - target))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build and query CDXJ sidecar indexes for WARC files')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help='Write <file>.cdxj next to each WARC')
+    p_build.add_argument('warc_files', nargs='+')
+
+    p_count = sub.add_parser('count', help='Count indexed response records')
+    p_count.add_argument('warc_file')
+
+    p_mime = sub.add_parser('mime', help='Print the MIME type breakdown of response records')
+    p_mime.add_argument('warc_file')
+
+    p_get = sub.add_parser('get', help='Print the payload of one capture of a URL')
+    p_get.add_argument('warc_file')
+    p_get.add_argument('url')
+    p_get.add_argument('--timestamp', help='Prefer the capture closest to this (partial) 14-digit timestamp')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        for idx, warc_file in enumerate(args.warc_files, start=1):
+            print(f"[{idx}/{len(args.warc_files)}] Indexing: {warc_file}")
+            print(f"  -> {build_index(warc_file)}")
+        return 0
+
+    cdxj_path = sidecar_path(args.warc_file)
+    if not os.path.exists(cdxj_path):
+        print(f"No index found at {cdxj_path}; run: python cdxj_index.py build {args.warc_file}", file=sys.stderr)
+        return 1
+
+    if args.command in ('count', 'mime'):
+        mime_counter: Counter = Counter()
+        for _, _, fields in read_index(cdxj_path):
+            if fields.get('mime') != REVISIT_MIME:
+                mime_counter[fields.get('mime')] += 1
+        if args.command == 'count':
+            print(f"Response records: {sum(mime_counter.values())}")
+        else:
+            # As in warc_scan.py --mime, responses without a Content-Type are not listed
+            mime_counter.pop(UNKNOWN_MIME, None)
+            for mime, count in mime_counter.most_common():
+                print(f"{count:>10}  {mime}")
+        return 0
+
+    entry = closest_entry(lookup(cdxj_path, args.url), args.timestamp)
+    if entry is None:
+        print(f"{args.url} not found in {cdxj_path}", file=sys.stderr)
+        return 1
+    fields = entry[2]
+    record = fetch_record(args.warc_file, int(fields['offset']), int(fields['length']))
+    sys.stdout.buffer.write(record.content_stream().read())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,13 +1,68 @@
 #!/usr/bin/env python3
-from warcio.archiveiterator import ArchiveIterator
+from warc_scan import ResponseCounter, iter_warc_headers, scan_warc
+from warc_summary_cache import SummaryCache
+from collections import Counter
+import argparse
 import sys
 
-filename = sys.argv[1]
-count = 0
 
-with open(filename, 'rb') as stream:
-    for record in ArchiveIterator(stream):
-        if record.rec_type == 'response':
-            count += 1
+def count_record_types(filename):
+    """Return {WARC-Type: [records, block bytes]} from the WARC headers only."""
+    summary = {}
+    for headers, length in iter_warc_headers(filename):
+        entry = summary.setdefault(headers.get('warc-type', 'unknown'), [0, 0])
+        entry[0] += 1
+        entry[1] += length
+    return summary
 
-print(f"Response records: {count}")
\ No newline at end of file
+
+def count_responses(filename):
+    count, = scan_warc(filename, [ResponseCounter()])
+    return count
+
+
+def cached(cache, filename, kind, compute):
+    """Serve a summary from the cache, computing and storing it if missing or stale."""
+    if cache is None:
+        return compute(filename)
+    summary, identity = cache.lookup(filename, kind)
+    if summary is None:
+        summary = compute(filename)
+        cache.store(identity, kind, summary)
+    return summary
+
+
+parser = argparse.ArgumentParser(description='Count records in a WARC or WARC.GZ file')
+parser.add_argument('filenames', nargs='+', metavar='filename', help='Path to the input WARC or WARC.GZ file (several may be given)')
+parser.add_argument('--headers-only', action='store_true',
+                    help='Only parse WARC headers and report counts and block bytes for every WARC-Type')
+parser.add_argument('--cache', help='SQLite summary cache; unchanged files are not scanned again')
+args = parser.parse_args()
+
+cache = SummaryCache(args.cache) if args.cache else None
+
+if args.headers_only:
+    counts = Counter()
+    sizes = Counter()
+    for filename in args.filenames:
+        for rec_type, (count, size) in cached(cache, filename, 'record_types', count_record_types).items():
+            counts[rec_type] += count
+            sizes[rec_type] += size
+
+    print(f"{'WARC-Type':<12} {'Records':>10} {'Bytes':>16}")
+    for rec_type, count in counts.most_common():
+        print(f"{rec_type:<12} {count:>10} {sizes[rec_type]:>16}")
+    print(f"{'total':<12} {sum(counts.values()):>10} {sum(sizes.values()):>16}")
+else:
+    total = 0
+    for filename in args.filenames:
+        count = cached(cache, filename, 'responses', count_responses)
+        if len(args.filenames) > 1:
+            print(f"{count:>10}  {filename}")
+        total += count
+
+    print(f"Response records: {total}")
+
+if cache is not None:
+    print(f"Summaries from cache: {cache.hits}/{cache.hits + cache.misses} files", file=sys.stderr)
+    cache.close()
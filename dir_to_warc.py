@@ -6,63 +6,232 @@
 # based on a provided base URL. The crawl date can be set manually or defaults
 # to the current UTC time. Useful for preserving static sites or file trees in
 # a format compatible with web archiving tools.
+#
+# Payloads are streamed from disk, so memory use does not depend on file size.
+# With --workers N, records are built and gzip-compressed by N threads (zlib and
+# hashlib release the GIL) into in-memory buffers and appended to the output in
+# the sorted walk order, so the record order does not depend on scheduling.
+# Files larger than SPOOL_SIZE are compressed directly into the output by the
+# main thread when their turn comes, while the workers prepare the next ones.
+#
+# With --manifest, the run is incremental: a SQLite manifest remembers size,
+# mtime and payload digest of every archived file. Unchanged files are skipped
+# without being read, new or changed files are appended to the output WARC,
+# and content already archived (under any path) is written as a revisit record.
 # -
 
 import os
 import argparse
+import base64
+import hashlib
 import mimetypes
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from warcio.warcwriter import WARCWriter
 from warcio.statusandheaders import StatusAndHeaders
-from io import BytesIO
 from datetime import datetime
 
+from warc_dedup import DigestIndex, write_revisit
 
-parser = argparse.ArgumentParser(description="Archive a directory to WARC format.")
-parser.add_argument("input_dir", help="Directory to archive")
-parser.add_argument("output_file", help="Output WARC file (e.g., archive.warc.gz)")
-parser.add_argument("url", help="Base URL for the archived files")
-parser.add_argument("--date", help="Crawl date in ISO format (e.g., 2020-01-01T12:00:00Z)")
-
-args = parser.parse_args()
-
-input_dir = args.input_dir
-output_file = args.output_file
+# Files up to this size are compressed by the workers into memory buffers
+SPOOL_SIZE = 8 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 # Ensure .shtml files are recognized as HTML
 mimetypes.add_type('text/html', '.shtml')
 
 
-# Use provided date or default to now in ISO format
-warc_date = args.date or datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+class FileManifest:
+    """Size, mtime and payload digest of every file archived so far.
 
+    Stored next to the payload digest index (see warc_dedup.py) in one
+    SQLite file, keyed on the path relative to the input directory.
+    """
 
-# Create WARC file
-with open(output_file, 'wb') as output:
-    writer = WARCWriter(output, gzip=True)
+    def __init__(self, path):
+        self.digests = DigestIndex(path)
+        self.conn = self.digests.conn
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' digest TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self.conn.commit()
 
-    for root, _, files in os.walk(input_dir):
-        for fname in files:
-            path = os.path.join(root, fname)
-            rel_path = os.path.relpath(path, input_dir)
-            base_url = args.url.rstrip('/') + '/'
-            url = base_url + rel_path.replace(os.sep, '/')
-
-            with open(path, 'rb') as f:
-                content = f.read()
+    def get(self, rel_path):
+        return self.conn.execute('SELECT size, mtime_ns, digest FROM files WHERE path = ?', (rel_path,)).fetchone()
 
-            # guess_type is case-sensitive on some platforms; normalize to lowercase
-            content_type = mimetypes.guess_type(fname.lower())[0] or 'application/octet-stream'
+    def put(self, rel_path, size, mtime_ns, digest):
+        self.conn.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                          (rel_path, size, mtime_ns, digest))
 
-            http_headers = StatusAndHeaders('200 OK', [('Content-Type', content_type)], protocol='HTTP/1.1')
+    def close(self):
+        self.digests.close()
 
-            record = writer.create_warc_record(
-                url,
-                'response',
-                payload=BytesIO(content),
-                http_headers=http_headers,
-                warc_headers_dict={'WARC-Date': warc_date}
-            )
-            writer.write_record(record)
 
-print(f"WARC file created: {output_file}")
+def iter_files(input_dir, base_url):
+    """Yield (path, rel_path, url) for every file below input_dir in sorted order."""
+    base_url = base_url.rstrip('/') + '/'
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            path = os.path.join(root, fname)
+            rel_path = os.path.relpath(path, input_dir)
+            yield path, rel_path, base_url + rel_path.replace(os.sep, '/')
+
+
+def file_digest(path):
+    """Return the payload digest of a file in WARC form (`sha1:<base32>`)."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return 'sha1:' + base64.b32encode(h.digest()).decode('ascii')
+
+
+def plan_records(input_dir, base_url, warc_date, manifest=None, stats=None):
+    """Yield (path, url, digest, original) for every record to write.
+
+    Without a manifest every file is written and digest/original are None.
+    With one, unchanged files are skipped; `original` is the `(uri, date)` of
+    an earlier capture with the same content, which makes the record a revisit.
+    """
+    for path, rel_path, url in iter_files(input_dir, base_url):
+        if manifest is None:
+            yield path, url, None, None
+            continue
+
+        st = os.stat(path)
+        known = manifest.get(rel_path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            stats['unchanged'] += 1
+            continue
+
+        digest = file_digest(path)
+        manifest.put(rel_path, st.st_size, st.st_mtime_ns, digest)
+        if known and known[2] == digest:
+            # Touched but not modified
+            stats['unchanged'] += 1
+            continue
+
+        original = manifest.digests.lookup_or_add(digest, url, warc_date)
+        stats['revisit' if original else 'response'] += 1
+        yield path, url, digest, original
+
+
+def make_http_headers(path):
+    # guess_type is case-sensitive on some platforms; normalize to lowercase
+    content_type = mimetypes.guess_type(os.path.basename(path).lower())[0] or 'application/octet-stream'
+
+    return StatusAndHeaders('200 OK', [('Content-Type', content_type)], protocol='HTTP/1.1')
+
+
+def write_file_record(writer, path, url, warc_date, digest=None):
+    """Write one file as a WARC response record, streaming it from disk."""
+    warc_headers = {'WARC-Date': warc_date}
+    if digest:
+        # Already known, saves warcio a pass over the file
+        warc_headers['WARC-Payload-Digest'] = digest
+
+    with open(path, 'rb') as f:
+        record = writer.create_warc_record(
+            url,
+            'response',
+            payload=f,
+            length=os.fstat(f.fileno()).st_size,
+            http_headers=make_http_headers(path),
+            warc_headers_dict=warc_headers
+        )
+        writer.write_record(record)
+
+
+def write_planned_record(writer, item, warc_date):
+    path, url, digest, original = item
+    if original:
+        write_revisit(writer, url, warc_date, digest, original, http_headers=make_http_headers(path))
+    else:
+        write_file_record(writer, path, url, warc_date, digest)
+
+
+def build_record(item, warc_date):
+    """Build one gzip-compressed record in a spooled buffer (worker side)."""
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    write_planned_record(WARCWriter(buf, gzip=True), item, warc_date)
+    buf.seek(0)
+    return buf
+
+
+def dir_to_warc(input_dir, output_file, base_url, warc_date, workers=1, manifest_path=None):
+    """Archive input_dir into output_file; returns per-kind record counts.
+
+    With manifest_path the output is appended to and only new or changed
+    files are written.
+    """
+    manifest = FileManifest(manifest_path) if manifest_path else None
+    stats = {'response': 0, 'revisit': 0, 'unchanged': 0}
+    items = plan_records(input_dir, base_url, warc_date, manifest, stats)
+
+    with open(output_file, 'ab' if manifest else 'wb') as output:
+        writer = WARCWriter(output, gzip=True)
+        if workers <= 1:
+            for item in items:
+                write_planned_record(writer, item, warc_date)
+        else:
+            def append(entry):
+                if isinstance(entry, tuple):
+                    # Large file or revisit: write straight into the output
+                    # instead of spooling it first
+                    write_planned_record(writer, entry, warc_date)
+                else:
+                    with entry.result() as buf:
+                        shutil.copyfileobj(buf, output)
+
+            # Keep a bounded window of records in flight and append them in order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque()
+                for item in items:
+                    if item[3] or os.path.getsize(item[0]) > SPOOL_SIZE:
+                        in_flight.append(item)
+                    else:
+                        in_flight.append(executor.submit(build_record, item, warc_date))
+                    if len(in_flight) >= workers * 2:
+                        append(in_flight.popleft())
+                while in_flight:
+                    append(in_flight.popleft())
+
+    if manifest:
+        # Only remember files once their records are safely written
+        manifest.close()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive a directory to WARC format.")
+    parser.add_argument("input_dir", help="Directory to archive")
+    parser.add_argument("output_file", help="Output WARC file (e.g., archive.warc.gz)")
+    parser.add_argument("url", help="Base URL for the archived files")
+    parser.add_argument("--date", help="Crawl date in ISO format (e.g., 2020-01-01T12:00:00Z)")
+    parser.add_argument("--workers", "-w", type=int, default=1,
+                        help="Number of threads building and compressing records (default: 1)")
+    parser.add_argument("--manifest",
+                        help="SQLite manifest for incremental runs: append only new or changed files, "
+                             "write duplicate content as revisit records")
+
+    args = parser.parse_args()
+
+    # Use provided date or default to now in ISO format
+    warc_date = args.date or datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+
+    stats = dir_to_warc(args.input_dir, args.output_file, args.url, warc_date,
+                        workers=args.workers, manifest_path=args.manifest)
+
+    if args.manifest:
+        print(f"Appended {stats['response']} response and {stats['revisit']} revisit records, "
+              f"skipped {stats['unchanged']} unchanged files")
+    print(f"WARC file created: {args.output_file}")
@@ -3,11 +3,14 @@
 Compare two harvest directories and visualize snapshot distributions.
 
 Usage:
-        python3 harvest_comparator.py <original_dir> <modified_dir>
+        python3 harvest_comparator.py <original_dir> <modified_dir> [--workers 16] [--inventory-cache DIR]
 
 Description:
 - Collects file statistics and snapshot timestamps (from a
-    `waybackup_snapshots/` directory structure).
+    `waybackup_snapshots/` directory structure). File statistics come from
+    the parallel scandir walk in `harvest_inventory.py`. With
+    `--inventory-cache DIR` inventories are saved there and later runs
+    only re-list directories that changed, e.g. to watch a running harvest.
 - Generates histograms comparing harvest distributions between the two
     directories.
 
@@ -26,22 +29,13 @@ import matplotlib.pyplot as plt
 import argparse
 from datetime import datetime
 import re
+from harvest_inventory import DEFAULT_WORKERS, build_inventory, cached_inventory
 
-def collect_file_info(directory):
-    files_info = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_size = os.path.getsize(file_path)
-            file_date = datetime.fromtimestamp(os.path.getmtime(file_path))
-            file_type = file.split('.')[-1] if '.' in file else 'unknown'
-            files_info.append({
-                'path': file_path,
-                'size': file_size,
-                'date': file_date,
-                'type': file_type
-            })
-    return files_info
+def collect_file_info(directory, workers=DEFAULT_WORKERS, cache_dir=None):
+    """Return a DataFrame with path, size, date and type of every file."""
+    if cache_dir:
+        return cached_inventory(directory, cache_dir, workers=workers).to_dataframe()
+    return build_inventory(directory, workers=workers).to_dataframe()
 
 def collect_snapshot_dates(directory):
     """Extract snapshot dates from folder names in waybackup_snapshots structure."""
@@ -53,16 +47,16 @@ def collect_snapshot_dates(directory):
         return snapshot_dates
     
     # Iterate through site directories
-    for site_name in os.listdir(wayback_path):
-        site_path = os.path.join(wayback_path, site_name)
-        if not os.path.isdir(site_path):
+    for site_entry in os.scandir(wayback_path):
+        if not site_entry.is_dir():
             continue
+        site_name = site_entry.name
         
         # Iterate through timestamp folders
-        for folder_name in os.listdir(site_path):
-            folder_path = os.path.join(site_path, folder_name)
-            if not os.path.isdir(folder_path):
+        for folder_entry in os.scandir(site_entry.path):
+            if not folder_entry.is_dir():
                 continue
+            folder_name = folder_entry.name
             
             # Try to parse 14-digit timestamp from folder name
             match = re.match(r'(\d{14})', folder_name)
@@ -82,14 +76,10 @@ def collect_snapshot_dates(directory):
     
     return snapshot_dates
 
-def analyze_directory(dir1, dir2):
+def analyze_directory(dir1, dir2, workers=DEFAULT_WORKERS, cache_dir=None):
     # Collect file info
-    files_info_1 = collect_file_info(dir1)
-    files_info_2 = collect_file_info(dir2)
-
-    # Create DataFrames
-    df1 = pd.DataFrame(files_info_1)
-    df2 = pd.DataFrame(files_info_2)
+    df1 = collect_file_info(dir1, workers, cache_dir)
+    df2 = collect_file_info(dir2, workers, cache_dir)
 
     # Statistical Analysis
     for df, label in zip([df1, df2], ['Original', 'Modified']):
@@ -133,8 +123,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compare two harvest directories.")
     parser.add_argument("dir1", help="Path for the original harvest directory")
     parser.add_argument("dir2", help="Path for the modified harvest directory")
+    parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of directories listed concurrently (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--inventory-cache",
+                        help="Directory for saved inventories; later runs only re-list changed directories")
     
     args = parser.parse_args()
     
-    analyze_directory(args.dir1, args.dir2)
+    analyze_directory(args.dir1, args.dir2, workers=args.workers, cache_dir=args.inventory_cache)
 
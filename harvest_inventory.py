@@ -0,0 +1,425 @@
+"""harvest_inventory.py
+
+Fast file inventory of harvest directories, used by harvest_comparator.py.
+
+The tree is walked with `os.scandir`; file type and directory checks come
+from the directory entries themselves and each file costs a single
+`DirEntry.stat()` call. Subdirectories are fanned out to a thread pool, so
+many directories are listed concurrently, which hides the per-call latency
+of network filesystems such as NFS.
+
+The result is columnar: one array per field instead of one dict per file,
+and directory paths are stored once and referenced by index.
+
+Inventories can be saved as Parquet snapshots (relative path, size, mtime,
+site and 14-digit snapshot timestamp from the `waybackup_snapshots/<site>/
+<timestamp>/` layout), and two inventories can be diffed: a sorted merge
+join on the relative path reports added, missing and size-changed files
+and whole snapshots per site. Saved inventories are compared without
+walking the trees again.
+
+Incremental scans (`scan --save X --incremental`) start from the saved
+inventory: every directory is still stat'ed, but only directories whose
+mtime changed (an entry was added, removed or renamed) are listed again.
+Unchanged subtrees of a running harvest cost one stat per directory
+instead of one per file. Directories modified shortly before the previous
+scan are always listed again, to catch files that were still being written.
+Files rewritten in place, without any change to their directory, are only
+picked up by a full scan.
+
+Usage:
+        python3 harvest_inventory.py [--workers 16] scan <harvest_dir> [--save harvest.parquet [--incremental]]
+        python3 harvest_inventory.py diff <old_dir|old.parquet> <new_dir|new.parquet> [--output diff.csv]
+
+Dependencies:
+- numpy, pandas and pyarrow for saving and diffing inventories
+"""
+
+import os
+import re
+import sys
+import argparse
+import bisect
+import queue
+import time
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Directory listings in flight; I/O bound, so more than the CPU count
+DEFAULT_WORKERS = 16
+SNAPSHOTS_DIR = 'waybackup_snapshots'
+TIMESTAMP_RE = re.compile(r'(\d{14})')
+# Directories modified this close before the previous scan are listed again
+RESCAN_WINDOW_NS = 10 * 60 * 10**9
+
+
+def scan_directory(path):
+    """List one directory: returns (dir_mtime_ns, names, sizes, mtimes_ns, subdirectory names)."""
+    # Taken before listing, so changes made during the listing show up next time
+    dir_mtime = os.stat(path).st_mtime_ns
+    names = []
+    sizes = array('q')
+    mtimes = array('q')
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    names.append(entry.name)
+                    sizes.append(st.st_size)
+                    mtimes.append(st.st_mtime_ns)
+            except OSError:
+                # Vanished or unreadable entry (e.g. a broken symlink)
+                continue
+    return dir_mtime, names, sizes, mtimes, subdirs
+
+
+def check_directory(path, previous_mtime, stable_before):
+    """Return None if the directory is unchanged since the previous scan, else `scan_directory(path)`."""
+    if previous_mtime is not None:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == previous_mtime and mtime < stable_before:
+            return None
+    return scan_directory(path)
+
+
+class Inventory:
+    """Columnar file inventory of one directory tree.
+
+    `dirs` holds every directory (relative to `root`, '' for the root
+    itself) and `dir_mtimes_ns` its modification time; per file, `dir_index`,
+    `names`, `sizes` and `mtimes_ns` hold its directory, file name, size and
+    modification time. Files are ordered by directory, then name.
+    `scan_time_ns` is when the walk started; `listed` and `reused` count
+    directories listed and taken over from a previous inventory.
+    """
+
+    def __init__(self, root, scan_time_ns=None):
+        self.root = root
+        self.scan_time_ns = scan_time_ns or time.time_ns()
+        self.listed = 0
+        self.reused = 0
+        self.dirs = []
+        self.dir_mtimes_ns = array('q')
+        self.dir_index = array('I')
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes_ns = array('q')
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_directory(self, rel_dir, dir_mtime, names, sizes, mtimes):
+        order = sorted(range(len(names)), key=names.__getitem__)
+        index = len(self.dirs)
+        self.dirs.append(rel_dir)
+        self.dir_mtimes_ns.append(dir_mtime)
+        self.dir_index.extend([index] * len(order))
+        self.names.extend(names[i] for i in order)
+        self.sizes.extend(sizes[i] for i in order)
+        self.mtimes_ns.extend(mtimes[i] for i in order)
+
+    def directory_listings(self):
+        """Return {rel_dir: (dir_mtime_ns, names, sizes, mtimes_ns)} for every directory."""
+        listings = {}
+        start = 0
+        for index, rel_dir in enumerate(self.dirs):
+            # Files are grouped by directory, in directory order
+            end = bisect.bisect_right(self.dir_index, index, start)
+            listings[rel_dir] = (self.dir_mtimes_ns[index], self.names[start:end],
+                                 self.sizes[start:end], self.mtimes_ns[start:end])
+            start = end
+        return listings
+
+    def paths(self):
+        """Yield the full path of every file."""
+        dirs = [os.path.join(self.root, d) for d in self.dirs]
+        for index, name in zip(self.dir_index, self.names):
+            yield os.path.join(dirs[index], name)
+
+    def types(self):
+        """Yield the extension of every file ('unknown' without one)."""
+        for name in self.names:
+            yield name.rsplit('.', 1)[-1] if '.' in name else 'unknown'
+
+    def to_dataframe(self):
+        """Return a pandas DataFrame with path, size, date and type columns."""
+        import numpy as np
+        import pandas as pd
+        return pd.DataFrame({
+            'path': list(self.paths()),
+            'size': np.frombuffer(self.sizes, dtype=np.int64),
+            'date': pd.to_datetime(np.frombuffer(self.mtimes_ns, dtype=np.int64), unit='ns'),
+            'type': pd.Categorical(list(self.types())),
+        })
+
+
+def snapshot_of(rel_dir):
+    """Return (site, timestamp) of a directory below `waybackup_snapshots/<site>/<timestamp>`.
+
+    Both are '' for directories outside that layout.
+    """
+    parts = rel_dir.split(os.sep)
+    if SNAPSHOTS_DIR in parts:
+        rest = parts[parts.index(SNAPSHOTS_DIR) + 1:]
+        if rest:
+            match = TIMESTAMP_RE.match(rest[1]) if len(rest) > 1 else None
+            return rest[0], match.group(1) if match else ''
+    return '', ''
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print("Required package 'pyarrow' is not installed. Install with: pip install pyarrow", file=sys.stderr)
+        raise
+    return pyarrow, pyarrow.parquet
+
+
+def inventory_table(inventory):
+    """Return the inventory as a pyarrow Table sorted by relative path.
+
+    Columns: rel_path ('/'-separated), size, mtime_ns, site and timestamp.
+    """
+    import numpy as np
+    pa, _ = _require_pyarrow()
+
+    rel_dirs = [d.replace(os.sep, '/') + '/' if d else '' for d in inventory.dirs]
+    snapshots = [snapshot_of(d) for d in inventory.dirs]
+    dir_index = np.frombuffer(inventory.dir_index, dtype=np.uint32)
+
+    def per_directory(values):
+        # Dictionary-encode a per-directory value and expand it to every file
+        dictionary = sorted(set(values))
+        codes = {value: code for code, value in enumerate(dictionary)}
+        dir_codes = np.array([codes[v] for v in values], dtype=np.int32)
+        return pa.DictionaryArray.from_arrays(pa.array(dir_codes[dir_index]), pa.array(dictionary, pa.string()))
+
+    table = pa.table({
+        'rel_path': pa.array([rel_dirs[i] + name for i, name in zip(inventory.dir_index, inventory.names)], pa.string()),
+        'size': pa.array(np.frombuffer(inventory.sizes, dtype=np.int64)),
+        'mtime_ns': pa.array(np.frombuffer(inventory.mtimes_ns, dtype=np.int64)),
+        'site': per_directory([site for site, _ in snapshots]),
+        'timestamp': per_directory([ts for _, ts in snapshots]),
+    })
+    return table.sort_by('rel_path')
+
+
+def dirs_path(path):
+    """Companion file of a saved inventory holding its directories and their mtimes."""
+    return re.sub(r'\.parquet$', '', path) + '.dirs.parquet'
+
+
+def save_inventory(inventory, path):
+    """Write the inventory to a Parquet file, and its directories to `dirs_path(path)`."""
+    pa, pq = _require_pyarrow()
+    pq.write_table(inventory_table(inventory), path, compression='zstd')
+    dirs = pa.table({
+        'rel_dir': pa.array([d.replace(os.sep, '/') for d in inventory.dirs], pa.string()),
+        'mtime_ns': pa.array(inventory.dir_mtimes_ns, pa.int64()),
+    }).replace_schema_metadata({'root': inventory.root, 'scan_time_ns': str(inventory.scan_time_ns)})
+    pq.write_table(dirs, dirs_path(path), compression='zstd')
+
+
+def read_inventory(path):
+    """Rebuild an `Inventory` from `save_inventory()` output, e.g. to rescan it incrementally."""
+    _, pq = _require_pyarrow()
+    dirs = pq.read_table(dirs_path(path))
+    metadata = dirs.schema.metadata
+    files = pq.read_table(path, columns=['rel_path', 'size', 'mtime_ns'])
+
+    grouped = defaultdict(lambda: ([], array('q'), array('q')))
+    for rel_path, size, mtime in zip(files.column('rel_path').to_pylist(), files.column('size').to_pylist(),
+                                     files.column('mtime_ns').to_pylist()):
+        rel_dir, _, name = rel_path.rpartition('/')
+        names, sizes, mtimes = grouped[rel_dir]
+        names.append(name)
+        sizes.append(size)
+        mtimes.append(mtime)
+
+    inventory = Inventory(metadata[b'root'].decode('utf-8'), int(metadata[b'scan_time_ns']))
+    dir_mtimes = dict(zip(dirs.column('rel_dir').to_pylist(), dirs.column('mtime_ns').to_pylist()))
+    for rel_dir in sorted(dir_mtimes, key=lambda d: d.split('/')):
+        inventory.add_directory(rel_dir.replace('/', os.sep), dir_mtimes[rel_dir], *grouped.pop(rel_dir, ([], [], [])))
+    return inventory
+
+
+def cached_inventory(root, cache_dir, workers=DEFAULT_WORKERS):
+    """Incrementally rescan `root` against its inventory saved in `cache_dir`, and save the result."""
+    os.makedirs(cache_dir, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', os.path.abspath(root)).strip('_') or 'root'
+    path = os.path.join(cache_dir, name + '.parquet')
+    previous = read_inventory(path) if os.path.exists(dirs_path(path)) else None
+    inventory = build_inventory(root, workers=workers, previous=previous)
+    save_inventory(inventory, path)
+    return inventory
+
+
+def load_inventory(source, workers=DEFAULT_WORKERS):
+    """Return the inventory table of a saved `.parquet` inventory or of a directory."""
+    if os.path.isfile(source):
+        _, pq = _require_pyarrow()
+        return pq.read_table(source).sort_by('rel_path')
+    return inventory_table(build_inventory(source, workers=workers))
+
+
+def diff_inventories(old, new):
+    """Sorted merge join of two inventory tables on `rel_path`.
+
+    Returns (differences, per_site): a DataFrame with one row per added,
+    missing or size-changed file, and a per-site summary that also counts
+    snapshots (site and timestamp) present in only one of the inventories.
+    """
+    import numpy as np
+    import pandas as pd
+
+    old_paths = old.column('rel_path').to_numpy(zero_copy_only=False)
+    new_paths = new.column('rel_path').to_numpy(zero_copy_only=False)
+    old_sizes = old.column('size').to_numpy()
+    new_sizes = new.column('size').to_numpy()
+
+    # Both sides are sorted by path: find each old path's slot among the new paths
+    pos = np.searchsorted(new_paths, old_paths)
+    in_new = pos < len(new_paths)
+    in_new[in_new] = new_paths[pos[in_new]] == old_paths[in_new]
+    matched_new = np.zeros(len(new_paths), dtype=bool)
+    matched_new[pos[in_new]] = True
+    changed = np.zeros(len(old_paths), dtype=bool)
+    changed[in_new] = old_sizes[in_new] != new_sizes[pos[in_new]]
+
+    old_sites = old.column('site').to_numpy(zero_copy_only=False)
+    new_sites = new.column('site').to_numpy(zero_copy_only=False)
+    parts = [
+        pd.DataFrame({'site': old_sites[~in_new], 'rel_path': old_paths[~in_new], 'status': 'missing',
+                      'old_size': old_sizes[~in_new], 'new_size': pd.NA}),
+        pd.DataFrame({'site': new_sites[~matched_new], 'rel_path': new_paths[~matched_new], 'status': 'added',
+                      'old_size': pd.NA, 'new_size': new_sizes[~matched_new]}),
+        pd.DataFrame({'site': old_sites[changed], 'rel_path': old_paths[changed], 'status': 'size_changed',
+                      'old_size': old_sizes[changed], 'new_size': new_sizes[pos[changed]]}),
+    ]
+    differences = pd.concat(parts, ignore_index=True).sort_values(['site', 'rel_path'], kind='stable')
+
+    per_site = pd.DataFrame({
+        'old_files': pd.Series(old_sites).value_counts(),
+        'new_files': pd.Series(new_sites).value_counts(),
+    })
+    for status in ('added', 'missing', 'size_changed'):
+        per_site[status] = differences.loc[differences['status'] == status, 'site'].value_counts()
+
+    old_snapshots = old.select(['site', 'timestamp']).to_pandas().drop_duplicates()
+    new_snapshots = new.select(['site', 'timestamp']).to_pandas().drop_duplicates()
+    both = old_snapshots.merge(new_snapshots, how='outer', indicator=True)
+    both = both[both['timestamp'].astype(str) != '']
+    per_site['snapshots_missing'] = both.loc[both['_merge'] == 'left_only', 'site'].astype(str).value_counts()
+    per_site['snapshots_added'] = both.loc[both['_merge'] == 'right_only', 'site'].astype(str).value_counts()
+
+    per_site = per_site.fillna(0).astype('int64').sort_index()
+    per_site.index = per_site.index.astype(str).where(per_site.index.astype(str) != '', '-')
+    per_site.index.name = 'site'
+    return differences, per_site
+
+
+def build_inventory(root, workers=DEFAULT_WORKERS, previous=None):
+    """Walk `root` with `workers` threads and return its `Inventory`.
+
+    With a `previous` inventory of the same tree, directories whose mtime
+    is unchanged are not listed again; their files and subdirectories are
+    taken from `previous`. A `previous` inventory of another root is
+    ignored and the tree is scanned in full.
+    """
+    if previous is not None and os.path.realpath(previous.root) != os.path.realpath(root):
+        print(f"Saved inventory is of {previous.root}, not {root}; scanning in full", file=sys.stderr)
+        previous = None
+    inventory = Inventory(root)
+    known = previous.directory_listings() if previous is not None else {}
+    children = defaultdict(list)
+    for rel_dir in known:
+        if rel_dir:
+            children[os.path.dirname(rel_dir)].append(os.path.basename(rel_dir))
+    stable_before = previous.scan_time_ns - RESCAN_WINDOW_NS if previous is not None else None
+
+    listings = {}
+    # Finished listings arrive here in completion order
+    finished = queue.SimpleQueue()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(path, rel_dir):
+            previous_mtime = known[rel_dir][0] if rel_dir in known else None
+            future = executor.submit(check_directory, path, previous_mtime, stable_before)
+            future.add_done_callback(lambda f: finished.put((path, rel_dir, f)))
+
+        submit(root, '')
+        pending = 1
+        while pending:
+            path, rel_dir, future = finished.get()
+            pending -= 1
+            try:
+                listing = future.result()
+            except OSError:
+                # Unreadable directory; os.walk skips these too
+                continue
+            if listing is None:
+                listings[rel_dir] = known[rel_dir]
+                subdirs = children[rel_dir]
+                inventory.reused += 1
+            else:
+                listings[rel_dir] = listing[:4]
+                subdirs = listing[4]
+                inventory.listed += 1
+            for name in subdirs:
+                submit(os.path.join(path, name), os.path.join(rel_dir, name) if rel_dir else name)
+            pending += len(subdirs)
+
+    # Sort by path components so a directory's subtree directly follows it
+    for rel_dir in sorted(listings, key=lambda d: d.split(os.sep)):
+        inventory.add_directory(rel_dir, *listings.pop(rel_dir))
+    return inventory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory harvest directories and compare inventories.")
+    parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of directories listed concurrently (default: {DEFAULT_WORKERS})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_scan = sub.add_parser("scan", help="Walk a harvest directory and print totals")
+    p_scan.add_argument("directory", help="Harvest directory to walk")
+    p_scan.add_argument("--save", help="Write the inventory to this Parquet file")
+    p_scan.add_argument("--incremental", action="store_true",
+                        help="Start from the inventory saved at --save and only list changed directories")
+
+    p_diff = sub.add_parser("diff", help="Compare two harvests (directories or saved .parquet inventories)")
+    p_diff.add_argument("old", help="Original harvest directory or inventory")
+    p_diff.add_argument("new", help="Modified harvest directory or inventory")
+    p_diff.add_argument("--output", "-o", help="Write every added, missing and size-changed file to this CSV")
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        if args.incremental and not args.save:
+            parser.error("--incremental requires --save")
+        previous = None
+        if args.incremental and os.path.exists(dirs_path(args.save)):
+            previous = read_inventory(args.save)
+        inventory = build_inventory(args.directory, workers=args.workers, previous=previous)
+        print(f"Directories: {len(inventory.dirs)} ({inventory.listed} listed, {inventory.reused} unchanged)")
+        print(f"Total Files: {len(inventory)}")
+        print(f"Total Size: {sum(inventory.sizes) / (1024 * 1024):.2f} MB")
+        if args.save:
+            save_inventory(inventory, args.save)
+            print(f"Inventory saved to {args.save}")
+    else:
+        differences, per_site = diff_inventories(load_inventory(args.old, args.workers),
+                                                 load_inventory(args.new, args.workers))
+        print(per_site.to_string())
+        print(f"\nAdded: {(differences['status'] == 'added').sum()}  "
+              f"Missing: {(differences['status'] == 'missing').sum()}  "
+              f"Size changed: {(differences['status'] == 'size_changed').sum()}")
+        if args.output:
+            differences.to_csv(args.output, index=False)
+            print(f"Differences written to {args.output}")
@@ -1,14 +1,47 @@
 import requests
 import pandas as pd
+import argparse
+import csv
+import io
+import json
+import random
+import sqlite3
+import threading
 import time
-import sys
+import zlib
 import os
-from urllib.parse import urlparse
+from collections import Counter
+from urllib.parse import urlencode, urlparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    # Optional: pages are then parsed with the (slower) pandas CSV reader
+    pa = None
 
 CDX_API = "https://web.archive.org/cdx/search/cdx"
 DEFAULT_REQUEST_DELAY = 2 # please note that this is in seconds
 DEFAULT_WORKERS = 3
+# Requests per second allowed across all workers (one request every DEFAULT_REQUEST_DELAY seconds)
+DEFAULT_RATE = 1 / DEFAULT_REQUEST_DELAY
+# Captures per CDX request; larger sites are fetched in several pages
+DEFAULT_PAGE_SIZE = 10000
+# Only the CDX fields the statistics use
+CDX_FIELDS = ["urlkey", "timestamp", "mimetype", "statuscode"]
+# Hours a cached CDX response stays fresh
+DEFAULT_CACHE_TTL = 7 * 24
+# Attempts after the first for a CDX page that failed transiently
+DEFAULT_RETRIES = 5
+# Retry n waits a random time up to min(BACKOFF_CAP, BACKOFF_BASE * 2**n) seconds
+BACKOFF_BASE = 2
+BACKOFF_CAP = 120
+# Responses slower than this (seconds) stop the concurrency from growing
+DEFAULT_TARGET_LATENCY = 10
+# Statuses the CDX API answers with when it is throttling or overloaded
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; IAStatsFetcher/2.0)"
@@ -16,30 +49,314 @@ HEADERS = {
 
 MIME_TYPES = ["text/html", "image/jpeg", "image/png"]
 
+# The full histograms are JSON objects, e.g. {"text/html": 120, "image/png": 7}
+RESULT_COLUMNS = (
+    ["Site", "Presence in internet archive"]
+    + [f"Captures ({m})" for m in MIME_TYPES]
+    + ["Unique URLs", "Captures", "MIME types", "Status codes", "Captures per year"]
+)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second, bursts of up to `burst`.
+
+    Shared by all workers, so the request rate holds no matter how many
+    threads are querying. Waiting happens in the calling thread.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Take the token now, possibly going into debt; callers queued behind
+            # us then wait for their own slot instead of racing for the next one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Adaptive cap on concurrent requests (additive increase, multiplicative decrease).
+
+    Every response within `target_latency` raises the limit by 1/limit, i.e.
+    by about one request per round trip, up to `max_limit`. A throttled or
+    failed request halves it, at most once per round of requests: only
+    requests started after the last decrease can decrease it again.
+    """
+
+    def __init__(self, max_limit, target_latency=DEFAULT_TARGET_LATENCY, min_limit=1, decrease=0.5):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(min_limit)
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot; returns the start time to pass to `release()`."""
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, latency=None, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                if started > self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self.last_decrease = time.monotonic()
+            elif latency is not None and latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than a server's Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class CDXCache:
+    """SQLite store of raw CDX response pages, keyed on the query parameters.
+
+    Pages older than `ttl` seconds are fetched again; `lookup(..., ignore_ttl=True)`
+    serves them anyway, which is how offline runs re-aggregate without the network.
+    Shared by all workers.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " query TEXT PRIMARY KEY,"
+            " fetched REAL NOT NULL,"
+            " body BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(params):
+        return urlencode(sorted((k, str(v)) for k, v in params.items()))
+
+    def lookup(self, params, ignore_ttl=False):
+        """Return the cached body of the page for `params`, or None if missing or stale."""
+        with self.lock:
+            row = self.conn.execute("SELECT fetched, body FROM pages WHERE query = ?", (self.key(params),)).fetchone()
+            if row is not None and (ignore_ttl or time.time() - row[0] <= self.ttl):
+                self.hits += 1
+                return zlib.decompress(row[1])
+            self.misses += 1
+            return None
+
+    def store(self, params, body):
+        data = zlib.compress(body)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages (query, fetched, body) VALUES (?, ?, ?)",
+                              (self.key(params), time.time(), data))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class CDXClient:
+    """One keep-alive `requests.Session` for all workers, throttled by a shared `TokenBucket`.
+
+    Concurrent requests are capped by an `AIMDLimiter` that adapts between 1
+    and `pool_size`. Pages that fail with a throttling status, a timeout or a
+    connection error are retried up to `retries` times with jittered
+    exponential backoff. With a `CDXCache`, pages are served from it while
+    fresh and stored after being fetched; `offline` clients only read the
+    cache and never connect.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=1, pool_size=DEFAULT_WORKERS, timeout=30, cache=None, offline=False,
+                 retries=DEFAULT_RETRIES, target_latency=DEFAULT_TARGET_LATENCY, api=CDX_API):
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        # Enough pooled connections that no worker has to open a new one
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = TokenBucket(rate, burst)
+        self.concurrency = AIMDLimiter(pool_size, target_latency)
+        self.api = api
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.retries = retries
+        self.retried = 0
+
+    def get(self, params):
+        """One attempt at a CDX request; returns `(response, error)` and reports the outcome to the limiter."""
+        started = self.concurrency.acquire()
+        latency = None
+        throttled = False
+        try:
+            self.limiter.acquire()
+            sent = time.monotonic()
+            r = self.session.get(self.api, params=params, timeout=self.timeout)
+            latency = time.monotonic() - sent
+            throttled = r.status_code in RETRY_STATUSES
+            return r, None
+        except (requests.Timeout, requests.ConnectionError) as e:
+            throttled = True
+            return None, e
+        finally:
+            self.concurrency.release(started, latency, throttled)
+
+    def fetch_page(self, params):
+        """Return the body of one CDX response page, from the cache when it holds a fresh copy."""
+        # Responses of another endpoint (e.g. a local replay server) are cached apart
+        cache_params = params if self.api == CDX_API else dict(params, api=self.api)
+        if self.cache is not None:
+            body = self.cache.lookup(cache_params, ignore_ttl=self.offline)
+            if body is not None:
+                return body
+        if self.offline:
+            raise LookupError("CDX response not in the cache")
+
+        for attempt in range(self.retries + 1):
+            r, error = self.get(params)
+            if r is not None:
+                if r.status_code == 200:
+                    if self.cache is not None:
+                        self.cache.store(cache_params, r.content)
+                    return r.content
+                error = requests.HTTPError(f"CDX API returned {r.status_code}", response=r)
+                if r.status_code not in RETRY_STATUSES:
+                    raise error
+            if attempt == self.retries:
+                raise error
+            self.retried += 1
+            time.sleep(backoff_delay(attempt, r.headers.get("Retry-After") if r is not None else None))
+
+    def close(self):
+        self.session.close()
+
 
 def normalize_url(url):
     parsed = urlparse(url)
     return parsed.scheme + "://" + parsed.netloc + parsed.path if parsed.netloc else url
 
-def query_cdx(url):
-    """Query the Internet Archive CDX API for all captures of a URL"""
+def split_resume_key(body):
+    """Split a CDX page into its result lines and the resume key that follows them (or None)."""
+    if body.startswith(b"\n"):
+        results, key = b"", body
+    else:
+        results, sep, key = body.rstrip(b"\n").rpartition(b"\n\n")
+        if not sep:
+            return body, None
+    return results, key.strip().decode("utf-8") or None
+
+
+def read_cdx_page(results):
+    """Parse the result lines of a CDX page into a DataFrame of CDX_FIELDS string columns."""
+    if pa is not None:
+        table = pa_csv.read_csv(
+            io.BytesIO(results),
+            read_options=pa_csv.ReadOptions(column_names=CDX_FIELDS, use_threads=False),
+            parse_options=pa_csv.ParseOptions(delimiter=" ", quote_char=False, invalid_row_handler=lambda row: "skip"),
+            convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in CDX_FIELDS})
+        )
+        # Arrow-backed columns: no Python string object per value
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return pd.read_csv(io.BytesIO(results), sep=" ", header=None, names=CDX_FIELDS, dtype=str,
+                       keep_default_na=False, on_bad_lines="skip")
+
+
+def query_cdx(url, client, page_size=DEFAULT_PAGE_SIZE):
+    """Yield the captures under a URL as DataFrames of CDX_FIELDS, one per CDX page.
+
+    Results are fetched in pages of `page_size` captures chained with
+    showResumeKey, and each page is parsed into columns in one go, so memory
+    is bounded by the page size rather than by the size of the site. Raises
+    on HTTP and network errors.
+    """
     params = {
         "url": url + "/*",
-        "output": "json",
-        "collapse": "digest"
+        "collapse": "digest",
+        "fl": ",".join(CDX_FIELDS),
+        "limit": page_size,
+        "showResumeKey": "true"
     }
-    try:
-        r = requests.get(CDX_API, params=params, headers=HEADERS, timeout=30)
-        if r.status_code != 200:
-            print(f"Warning: CDX API returned {r.status_code} for {url}")
-            return []
-        data = r.json()
-        return data[1:]  
-    except Exception as e:
-        print(f"Error querying {url}: {e}")
-        return []
+    while True:
+        results, resume_key = split_resume_key(client.fetch_page(params))
+        if results.strip():
+            yield read_cdx_page(results)
+        if not resume_key:
+            return
+        params["resumeKey"] = resume_key
+
+
+class CaptureProfile:
+    """Capture statistics of one site, aggregated one CDX page at a time."""
+
+    def __init__(self):
+        self.captures = 0
+        self.unique_urls = 0
+        self.last_urlkey = ""
+        self.mime_types = Counter()
+        self.status_codes = Counter()
+        self.years = Counter()
+
+    def add_page(self, page):
+        if page.empty:
+            return
+        self.captures += len(page)
+        self.mime_types.update(page["mimetype"].value_counts().to_dict())
+        self.status_codes.update(page["statuscode"].value_counts().to_dict())
+        self.years.update(page["timestamp"].str[:4].value_counts().to_dict())
+        # CDX results are sorted by urlkey (across pages too), so unique URLs
+        # are the positions where the urlkey changes
+        keys = page["urlkey"]
+        self.unique_urls += int((keys != keys.shift(1, fill_value=self.last_urlkey)).sum())
+        self.last_urlkey = keys.iloc[-1]
 
-def scrape_ia_stats(site_url, index=None, total=None):
+    def result(self, site_url):
+        if not self.captures:
+            return {column: site_url if column == "Site" else "N/A" for column in RESULT_COLUMNS}
+        return {
+            "Site": site_url,
+            "Presence in internet archive": "Yes",
+            **{f"Captures ({m})": self.mime_types[m] for m in MIME_TYPES},
+            "Unique URLs": self.unique_urls,
+            "Captures": self.captures,
+            "MIME types": json.dumps(dict(self.mime_types.most_common())),
+            "Status codes": json.dumps(dict(self.status_codes.most_common())),
+            "Captures per year": json.dumps(dict(sorted(self.years.items())))
+        }
+
+
+def scrape_ia_stats(site_url, client, index=None, total=None, page_size=DEFAULT_PAGE_SIZE):
     """Scrape IA stats for a single site with optional progress display"""
     if index is not None and total is not None:
         print(f"Processing {index}/{total}: {site_url}")
@@ -47,97 +364,167 @@ def scrape_ia_stats(site_url, index=None, total=None):
         print(f"Processing: {site_url}")
 
     normalized = normalize_url(site_url)
-    all_caps = query_cdx(normalized)
+    profile = CaptureProfile()
+    try:
+        for page in query_cdx(normalized, client, page_size):
+            profile.add_page(page)
+    except Exception as e:
+        # Not the same as "no captures": the site is queried again on the next run
+        print(f"Error querying {normalized}: {e}")
+        return {column: site_url if column == "Site" else "Error" if column == "Presence in internet archive" else "N/A"
+                for column in RESULT_COLUMNS}
 
-    if not all_caps:
-        return {
-            "Site": site_url,
-            "Presence in internet archive": "N/A",
-            "Captures (text/html)": "N/A",
-            "Captures (image/jpeg)": "N/A",
-            "Captures (image/png)": "N/A",
-            "Unique URLs": "N/A"
-        }
+    return profile.result(site_url)
 
-    counts = {m: 0 for m in MIME_TYPES}
-    unique_urls = set()
-
-    for row in all_caps:
-        if len(row) < 4:
-            continue
-        mime = row[3]
-        if mime in counts:
-            counts[mime] += 1
-        unique_urls.add(row[2])
-
-    return {
-        "Site": site_url,
-        "Presence in internet archive": "Yes",
-        "Captures (text/html)": counts["text/html"],
-        "Captures (image/jpeg)": counts["image/jpeg"],
-        "Captures (image/png)": counts["image/png"],
-        "Unique URLs": len(unique_urls)
-    }
 
+class ResultWriter:
+    """Append result rows to the output CSV as soon as each site is done.
+
+    Sites already in an existing output are reported by `done`, so an
+    interrupted run can be restarted and only queries what is missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            previous = pd.read_csv(path, dtype=str, keep_default_na=False)
+            self.done = dict(zip(previous["Site"], previous["Presence in internet archive"]))
+            if list(previous.columns) != RESULT_COLUMNS:
+                # Output of an older version: bring it to the current columns before appending
+                previous.reindex(columns=RESULT_COLUMNS, fill_value="").to_csv(path, index=False, encoding="utf-8")
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_COLUMNS)
+        if not exists:
+            self.writer.writeheader()
+
+    def write(self, result):
+        self.writer.writerow(result)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def compact(self, urls):
+        """Rewrite the output with one row per site (the latest) in input order."""
+        df = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+        df = df.drop_duplicates("Site", keep="last")
+        order = {url: i for i, url in enumerate(urls)}
+        df = df.assign(_order=df["Site"].map(order).fillna(len(order))).sort_values("_order", kind="stable")
+        df.drop(columns="_order").to_csv(self.path, index=False, encoding="utf-8")
 
-def process_urls(urls, delay: int = DEFAULT_REQUEST_DELAY, parallel: bool = False, max_workers: int = DEFAULT_WORKERS):
+
+def process_urls(urls, client, parallel: bool = False, max_workers: int = DEFAULT_WORKERS,
+                 page_size: int = DEFAULT_PAGE_SIZE, on_result=None):
+    """Scrape every URL through one shared client, calling `on_result` as each site finishes."""
     results = []
     total = len(urls)
 
+    def finished(res):
+        results.append(res)
+        if on_result is not None:
+            on_result(res)
+
     if parallel:
-        per_worker_delay = delay / max_workers if max_workers > 0 else 0
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {
-                executor.submit(scrape_ia_stats, url, i + 1, total): url
-                for i, url in enumerate(urls)
-            }
-            for future in as_completed(future_to_url):
-                res = future.result()
-                results.append(res)
-                if per_worker_delay > 0:
-                    time.sleep(per_worker_delay)
+            futures = [executor.submit(scrape_ia_stats, url, client, i + 1, total, page_size) for i, url in enumerate(urls)]
+            for future in as_completed(futures):
+                finished(future.result())
     else:
         for i, url in enumerate(urls):
-            res = scrape_ia_stats(url, i + 1, total)
-            results.append(res)
-            if delay > 0:
-                time.sleep(delay)
+            finished(scrape_ia_stats(url, client, i + 1, total, page_size))
 
     return results
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python ia_stats_fetcher.py <input_csv> <output_csv> [--parallel] [--delay SECONDS] [--workers N]")
-        sys.exit(1)
-
-    input_csv = sys.argv[1]
-    output_csv = sys.argv[2]
-
-    # Parse optional arguments
-    parallel = "--parallel" in sys.argv
+    parser = argparse.ArgumentParser(description="Fetch Internet Archive capture statistics for a list of sites")
+    parser.add_argument("input_csv", help="CSV with the site URLs in its first column")
+    parser.add_argument("output_csv", help="Path of the CSV to write; sites already in it are skipped")
+    parser.add_argument("--parallel", action="store_true", help="Query several sites at once")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Maximum number of concurrent requests with --parallel; the actual number adapts "
+                             f"to how fast the CDX API answers (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--rate", type=float,
+                        help=f"Maximum CDX requests per second over all workers (default: {DEFAULT_RATE:g})")
+    parser.add_argument("--delay", type=float,
+                        help="Seconds between requests; shorthand for --rate 1/DELAY")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Requests that may be sent back to back before the rate applies (default: 1)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries of a CDX request that was throttled, failed or timed out (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--target-latency", type=float, default=DEFAULT_TARGET_LATENCY,
+                        help="Concurrency only grows while responses take less than this many seconds "
+                             f"(default: {DEFAULT_TARGET_LATENCY})")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"Captures fetched per CDX request (default: {DEFAULT_PAGE_SIZE})")
+    parser.add_argument("--cdx-api", default=CDX_API,
+                        help="CDX endpoint to query, e.g. a local wayback_replay_server.py (default: the Wayback Machine)")
+    parser.add_argument("--cache", help="SQLite cache of raw CDX responses")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL,
+                        help=f"Hours a cached CDX response is reused before it is fetched again (default: {DEFAULT_CACHE_TTL})")
+    parser.add_argument("--offline", action="store_true",
+                        help="Only use the --cache, whatever its age, and redo every site, including those already in the "
+                             "output; sites missing from the cache come out as Error or keep their earlier row")
+    parser.add_argument("--retry-missing", action="store_true",
+                        help="Query sites again whose earlier result is N/A instead of skipping them")
+    args = parser.parse_args()
 
-    delay_index = sys.argv.index("--delay") + 1 if "--delay" in sys.argv else None
-    delay = int(sys.argv[delay_index]) if delay_index else DEFAULT_REQUEST_DELAY
+    if args.offline and not args.cache:
+        parser.error("--offline needs --cache")
 
-    workers_index = sys.argv.index("--workers") + 1 if "--workers" in sys.argv else None
-    workers = int(sys.argv[workers_index]) if workers_index else DEFAULT_WORKERS
+    if args.rate is not None:
+        rate = args.rate
+    elif args.delay is not None:
+        rate = 1 / args.delay if args.delay > 0 else 0
+    else:
+        rate = DEFAULT_RATE
 
     # Read URLs from CSV (assumes first column contains URLs)
-    df = pd.read_csv(input_csv)
+    df = pd.read_csv(args.input_csv)
     url_column = df.columns[0]
     urls = [str(u).strip() for u in df[url_column] if str(u).strip()]
 
-    print(f"Processing {len(urls)} URLs {'in parallel' if parallel else 'sequentially'} with {workers} worker(s)...")
+    writer = ResultWriter(args.output_csv)
+    on_result = writer.write
+    if args.offline:
+        # Re-aggregating from the cache is cheap, so every site is redone
+        todo = urls
+
+        def on_result(result):
+            # A site missing from the cache keeps its earlier row
+            if result["Presence in internet archive"] != "Error" or result["Site"] not in writer.done:
+                writer.write(result)
+    else:
+        # Sites that failed last time are always queried again
+        todo = [u for u in urls
+                if writer.done.get(u, "Error") == "Error" or (args.retry_missing and writer.done[u] == "N/A")]
+    if len(todo) < len(urls):
+        print(f"Skipping {len(urls) - len(todo)} sites already in {args.output_csv}")
 
-    results = process_urls(urls, delay=delay, parallel=parallel, max_workers=workers)
+    workers = args.workers if args.parallel else 1
+    limit = f"at most {rate:g} requests/s" if rate > 0 else "no rate limit"
+    print(f"Processing {len(todo)} URLs {'in parallel' if args.parallel else 'sequentially'} with up to {workers} worker(s), {limit}...")
 
-    # Save results
-    out_df = pd.DataFrame(results)
-    os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
-    out_df.to_csv(output_csv, index=False, encoding="utf-8")
+    cache = CDXCache(args.cache, ttl=args.cache_ttl * 3600) if args.cache else None
+    client = CDXClient(rate=rate, burst=args.burst, pool_size=workers, cache=cache, offline=args.offline,
+                       retries=args.retries, target_latency=args.target_latency, api=args.cdx_api)
+    try:
+        process_urls(todo, client, parallel=args.parallel, max_workers=workers, page_size=args.page_size,
+                     on_result=on_result)
+    finally:
+        client.close()
+        writer.close()
+        print(f"Retried requests: {client.retried}, final concurrency: {int(client.concurrency.limit)}")
+        if cache is not None:
+            print(f"CDX pages from cache: {cache.hits}/{cache.hits + cache.misses}")
+            cache.close()
 
-    print(f"\nCSV generated: {output_csv}")
+    writer.compact(urls)
+    print(f"\nCSV generated: {args.output_csv}")
 
 
 if __name__ == "__main__":
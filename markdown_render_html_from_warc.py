@@ -1,20 +1,31 @@
+import hashlib
+import json
 import os
 import re
+import sqlite3
+import sys
+import zipfile
+import zlib
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
-from warcio.archiveiterator import ArchiveIterator
+from warc_filter import add_filter_arguments, filter_from_args, scan_filtered
+from warc_scan import WarcConsumer, ScannedRecord
 """markdown_render_html_from_warc
 
-Convert HTML responses inside a WARC/WARC.GZ archive into individual
-Markdown files.
+Convert HTML responses inside a WARC/WARC.GZ archive into Markdown,
+written as individual files or packed into a single output file.
 
 Behavior:
 - Scans each WARC `response` record and selects those with a
     `Content-Type` containing `text/html`.
 - Converts the HTML payload to Markdown using `html2text`.
-- Writes one `.md` file per page under the configured output
+- By default writes one `.md` file per page under the configured output
     directory. Each file begins with a single metadata line in the
     format `waybackdate/original-url` followed by the converted
     Markdown body.
+- With `--format jsonl.zst|zip|parquet` all pages are streamed into one
+    file instead (see `OUTPUT_FORMATS`), which avoids millions of tiny
+    files for large crawls.
 
 Output filename format:
 - `{waybackdate}_{safe_url}.md` where `waybackdate` is derived
@@ -28,68 +39,456 @@ Limitations and notes:
 - HTML→Markdown conversion is best-effort; complex pages may need
     post-processing.
 - Non-UTF8 bytes are decoded with errors ignored to avoid crashes.
+- With `--workers N` the WARC is still read once by the main process;
+    conversion runs in a pool of N processes and the main process writes
+    the output.
+- With `--cache FILE`, converted Markdown is cached by payload digest so
+    duplicate payloads (and re-runs) skip `html2text`; `--resume` continues
+    an interrupted run from the last checkpoint stored in the same file.
+- Record filters (`--url-glob`, `--surt-prefix`, `--from`/`--to`, ...,
+    see warc_filter.py) skip non-matching pages on their headers; with an
+    up-to-date CDXJ sidecar only the matching records are read at all.
 
 Example usage:
 ```
 python markdown_render_html_from_warc.py archive.warc.gz --output-dir markdown_pages
+python markdown_render_html_from_warc.py archive.warc.gz --output-dir markdown_pages --workers 8
+python markdown_render_html_from_warc.py archive.warc.gz --format jsonl.zst -o pages.jsonl.zst
+python markdown_render_html_from_warc.py archive.warc.gz --surt-prefix 'com,example)/' --from 2003 --to 2003
 ```
 """
 import html2text
 import argparse
 
-# ======== CONFIGURATION ========
-parser = argparse.ArgumentParser(description='Render HTML pages from a WARC file into Markdown files')
-parser.add_argument('warc_file', help='Path to the input WARC or WARC.GZ file')
-parser.add_argument('--output-dir', '-o', default='markdown_pages', help='Directory to write Markdown files to (default: markdown_pages)')
-args = parser.parse_args()
-
-WARC_FILE = args.warc_file
-OUTPUT_DIR = args.output_dir
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# Set up HTML → Markdown converter
-converter = html2text.HTML2Text()
-converter.ignore_links = False
-converter.ignore_images = False
-converter.body_width = 0  # no line wrapping
-
-# ======== MAIN PROCESS ========
-count = 0
-
-with open(WARC_FILE, "rb") as stream:
-    for record in ArchiveIterator(stream):
-        if record.rec_type == "response":
-            content_type = record.http_headers.get_header("Content-Type") or ""
-            if "text/html" in content_type.lower():
-                # Extract metadata
-                url = record.rec_headers.get_header("WARC-Target-URI") or "unknown_url"
-                warc_date = record.rec_headers.get_header("WARC-Date") or ""
-
-                # Convert date to a filesystem-friendly format
-                try:
-                    wayback_date = datetime.strptime(warc_date, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y%m%d%H%M%S")
-                except Exception:
-                    wayback_date = "unknown_date"
-
-                # Create a safe filename from the URL
-                safe_url = re.sub(r"[^a-zA-Z0-9._-]+", "_", url)
-                filename = f"{wayback_date}_{safe_url}.md"
-
-                # Limit filename length (to avoid filesystem issues)
-                if len(filename) > 200:
-                    filename = filename[:200] + ".md"
-
-                filepath = os.path.join(OUTPUT_DIR, filename)
-
-                # Extract and convert HTML
-                html_content = record.content_stream().read().decode("utf-8", errors="ignore")
-                markdown_content = converter.handle(html_content)
-
-                with open(filepath, "w", encoding="utf-8") as f:
-                    # Write a single metadata line in the format: waybackdate/original-url
-                    f.write(f"{wayback_date}/{url}\n\n")
-                    f.write(markdown_content)
-
-                count += 1
-
-print(f"Extracted and converted {count} HTML pages to Markdown in '{OUTPUT_DIR}/'")
+# Pages between two checkpoints of a resumable run
+CHECKPOINT_EVERY = 500
+ZSTD_LEVEL = 10
+# Pages per Parquet row group; bounds the rows buffered in memory
+PARQUET_ROW_GROUP = 1000
+
+
+def make_converter():
+    """Set up an HTML → Markdown converter."""
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = False
+    converter.body_width = 0  # no line wrapping
+    return converter
+
+
+def wayback_date_from_warc(warc_date):
+    """Convert a `WARC-Date` value to a filesystem-friendly format."""
+    try:
+        return datetime.strptime(warc_date, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y%m%d%H%M%S")
+    except Exception:
+        return "unknown_date"
+
+
+def markdown_filename(wayback_date, url, suffix=""):
+    """Create a safe filename from the URL."""
+    safe_url = re.sub(r"[^a-zA-Z0-9._-]+", "_", url)
+    filename = f"{wayback_date}_{safe_url}"
+
+    # Limit filename length (to avoid filesystem issues)
+    if len(filename) > 200:
+        filename = filename[:200]
+    return f"{filename}{suffix}.md"
+
+
+def markdown_document(wayback_date, url, markdown_content):
+    # A single metadata line in the format: waybackdate/original-url
+    return f"{wayback_date}/{url}\n\n{markdown_content}"
+
+
+def unique_filename(wayback_date, url, document, read_existing):
+    """Pick the name for a page, or None if the same document is already stored.
+
+    Pages normally get `markdown_filename`. Captures of one URL within the same
+    second, URLs that only differ in replaced characters and long URLs cut at
+    the same length share that name, so a different document stored under it
+    gets a suffix from its own digest instead of replacing it. The choice
+    depends only on what is stored, so a resumed run writes to the same names.
+    `read_existing(name)` returns the stored document or None.
+    """
+    filename = markdown_filename(wayback_date, url)
+    existing = read_existing(filename)
+    if existing is None:
+        return filename
+    if existing == document:
+        return None
+    digest = hashlib.sha1(document.encode("utf-8")).hexdigest()[:12]
+    filename = markdown_filename(wayback_date, url, suffix=f"_{digest}")
+    return None if read_existing(filename) is not None else filename
+
+
+class MarkdownFiles:
+    """One `.md` file per page in a directory."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, wayback_date, url, markdown_content):
+        document = markdown_document(wayback_date, url, markdown_content)
+        filename = unique_filename(wayback_date, url, document, self._read)
+        if filename is not None:
+            with open(os.path.join(self.output_dir, filename), "w", encoding="utf-8") as f:
+                f.write(document)
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.output_dir, filename), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MarkdownJsonlZstd:
+    """Zstandard-compressed JSON Lines, one `{wayback_date, url, markdown}` object per page.
+
+    The file is opened for appending; every run (and every flush) ends a zstd
+    frame, and concatenated frames decompress as one stream (`zstd -dc`).
+    """
+
+    def __init__(self, path):
+        try:
+            import zstandard
+        except ImportError:
+            print("Required package 'zstandard' is not installed. Install with: pip install zstandard", file=sys.stderr)
+            raise
+        self.frame_end = zstandard.FLUSH_FRAME
+        self.writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, "ab"))
+
+    def write(self, wayback_date, url, markdown_content):
+        line = json.dumps({"wayback_date": wayback_date, "url": url, "markdown": markdown_content}, ensure_ascii=False)
+        self.writer.write((line + "\n").encode("utf-8"))
+
+    def flush(self):
+        self.writer.flush(self.frame_end)
+
+    def close(self):
+        self.writer.close()
+
+
+class MarkdownZip:
+    """A deflated ZIP with one `.md` entry per page, named as in directory output.
+
+    Entry names are unique (see `unique_filename`), so no entry shadows another.
+
+    Existing archives are appended to. The central directory is only written
+    on close, so an interrupted run leaves an unreadable archive.
+    """
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path, "a", compression=zipfile.ZIP_DEFLATED)
+        self.names = set(self.zip.namelist())
+
+    def write(self, wayback_date, url, markdown_content):
+        document = markdown_document(wayback_date, url, markdown_content)
+        filename = unique_filename(wayback_date, url, document, self._read)
+        if filename is not None:
+            self.zip.writestr(filename, document)
+            self.names.add(filename)
+
+    def _read(self, filename):
+        if filename not in self.names:
+            return None
+        return self.zip.read(filename).decode("utf-8")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.zip.close()
+
+
+class MarkdownParquet:
+    """A Parquet table with `wayback_date`, `url` and `markdown` columns.
+
+    Rows are written in row groups of `PARQUET_ROW_GROUP` pages. Parquet files
+    cannot be appended to, so an existing file is refused.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print("Required package 'pyarrow' is not installed. Install with: pip install pyarrow", file=sys.stderr)
+            raise
+        if os.path.exists(path):
+            raise FileExistsError(f"Parquet output '{path}' already exists and cannot be appended to")
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([("wayback_date", pyarrow.string()),
+                                      ("url", pyarrow.string()),
+                                      ("markdown", pyarrow.string())])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        self.rows = []
+
+    def write(self, wayback_date, url, markdown_content):
+        self.rows.append((wayback_date, url, markdown_content))
+        if len(self.rows) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = [list(column) for column in zip(*self.rows)]
+            self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# --format choice -> (writer class, default output name)
+OUTPUT_FORMATS = {
+    "files": (MarkdownFiles, "markdown_pages"),
+    "jsonl.zst": (MarkdownJsonlZstd, "markdown_pages.jsonl.zst"),
+    "zip": (MarkdownZip, "markdown_pages.zip"),
+    "parquet": (MarkdownParquet, "markdown_pages.parquet"),
+}
+
+
+class MarkdownCache:
+    """Persistent Markdown cache keyed on payload digest, plus run checkpoints.
+
+    Converted Markdown is stored zlib-compressed in an SQLite file, once per
+    distinct payload. The same file keeps, per WARC, the offset from which an
+    interrupted run can resume.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS markdown (digest TEXT PRIMARY KEY, body BLOB NOT NULL) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (warc TEXT PRIMARY KEY, next_offset INTEGER NOT NULL)')
+        self.conn.commit()
+
+    def get(self, digest):
+        row = self.conn.execute('SELECT body FROM markdown WHERE digest = ?', (digest,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def put(self, digest, markdown_content):
+        self.conn.execute('INSERT OR REPLACE INTO markdown (digest, body) VALUES (?, ?)',
+                          (digest, zlib.compress(markdown_content.encode("utf-8"))))
+
+    def get_checkpoint(self, warc):
+        row = self.conn.execute('SELECT next_offset FROM checkpoints WHERE warc = ?', (warc,)).fetchone()
+        return row[0] if row else 0
+
+    def set_checkpoint(self, warc, next_offset):
+        """Record the resume offset and commit it together with cached pages."""
+        self.conn.execute('INSERT OR REPLACE INTO checkpoints (warc, next_offset) VALUES (?, ?)', (warc, next_offset))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def payload_digest(record, payload):
+    """Return the WARC-Payload-Digest of a record, or a SHA-1 of the payload."""
+    return record.rec_headers.get_header("WARC-Payload-Digest") or "sha1:" + hashlib.sha1(payload).hexdigest()
+
+
+# Converter of a worker process in parallel mode, see _init_worker()
+_worker_converter = None
+
+
+def _init_worker():
+    global _worker_converter
+    _worker_converter = make_converter()
+
+
+def convert_html(converter, payload):
+    """Convert an HTML payload to Markdown."""
+    html_content = payload.decode("utf-8", errors="ignore")
+    return converter.handle(html_content)
+
+
+def _convert_in_worker(payload):
+    return convert_html(_worker_converter, payload)
+
+
+class MarkdownExporter(WarcConsumer):
+    """Convert every HTML `response` record and write it in `output_format`.
+
+    With `workers > 1`, conversion runs in a process pool, each worker with
+    its own converter, and the main process writes the results as they come
+    back. At most `workers * 4` pages are queued at a time, so memory stays
+    bounded while the scan streams on.
+
+    With a `MarkdownCache`, pages whose payload digest was converted before
+    are written from the cache, and every `CHECKPOINT_EVERY` pages the offset
+    before the oldest unfinished page is stored under `checkpoint_key`.
+
+    Several exporters (one per WARC) can share a `sink`; it is then only
+    flushed by `finish()` and the caller closes it.
+    """
+
+    needs_payload = True
+
+    def __init__(self, output, workers=1, cache=None, checkpoint_key=None, output_format="files", sink=None):
+        self.output = output
+        self.owns_sink = sink is None
+        if sink is None:
+            writer_class, _ = OUTPUT_FORMATS[output_format]
+            sink = writer_class(output)
+        self.sink = sink
+        self.converter = make_converter()
+        self.count = 0
+        self.cache_hits = 0
+
+        self.cache = cache
+        self.checkpoint_key = checkpoint_key
+        # Offset where the scan continues after the last page handed to us
+        self.next_offset = None
+
+        self.executor = None
+        # future -> (digest, record offset, wayback date, url)
+        self.in_flight = {}
+        # digest -> pages waiting for a conversion already in flight
+        self.waiting = {}
+        self.max_in_flight = workers * 4
+        if workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def accepts(self, record):
+        if record.rec_type != "response":
+            return False
+        content_type = record.http_headers.get_header("Content-Type") or ""
+        return "text/html" in content_type.lower()
+
+    def consume(self, item: ScannedRecord):
+        if item.payload is None:
+            return
+
+        if self.in_flight:
+            # Pick up finished pages without blocking
+            self._collect(FIRST_COMPLETED, timeout=0)
+
+        # Extract metadata
+        record = item.record
+        url = record.rec_headers.get_header("WARC-Target-URI") or "unknown_url"
+        wayback_date = wayback_date_from_warc(record.rec_headers.get_header("WARC-Date") or "")
+        # next_offset only moves past this page once it is written or in
+        # flight, so a checkpoint taken meanwhile cannot skip it
+
+        digest = None
+        if self.cache is not None:
+            digest = payload_digest(record, item.payload)
+            if digest in self.waiting:
+                self.waiting[digest].append((wayback_date, url))
+                self.next_offset = item.next_offset
+                return
+            cached = self.cache.get(digest)
+            if cached is not None:
+                self.sink.write(wayback_date, url, cached)
+                self.cache_hits += 1
+                self.next_offset = item.next_offset
+                self._page_done()
+                return
+
+        if self.executor is None:
+            markdown_content = convert_html(self.converter, item.payload)
+            self.sink.write(wayback_date, url, markdown_content)
+            if digest is not None:
+                self.cache.put(digest, markdown_content)
+            self.next_offset = item.next_offset
+            self._page_done()
+            return
+
+        if len(self.in_flight) >= self.max_in_flight:
+            self._collect(FIRST_COMPLETED)
+        future = self.executor.submit(_convert_in_worker, item.payload)
+        self.in_flight[future] = (digest, item.offset, wayback_date, url)
+        self.next_offset = item.next_offset
+        if digest is not None:
+            self.waiting[digest] = []
+
+    def _collect(self, return_when, timeout=None):
+        done, _ = wait(self.in_flight, timeout=timeout, return_when=return_when)
+        for future in done:
+            digest, _, wayback_date, url = self.in_flight.pop(future)
+            markdown_content = future.result()
+            self.sink.write(wayback_date, url, markdown_content)
+            if digest is not None:
+                self.cache.put(digest, markdown_content)
+                # Duplicates that arrived while the page was converting
+                for wayback_date, url in self.waiting.pop(digest):
+                    self.sink.write(wayback_date, url, markdown_content)
+                    self.cache_hits += 1
+                    self._page_done()
+            self._page_done()
+
+    def _page_done(self):
+        self.count += 1
+        if self.checkpoint_key and self.count % CHECKPOINT_EVERY == 0:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # Resume before the oldest page still converting, so no page is lost
+        offsets = [offset for _, offset, _, _ in self.in_flight.values()]
+        resume_at = min(offsets) if offsets else self.next_offset
+        if resume_at is not None and resume_at >= 0:
+            self.sink.flush()
+            self.cache.set_checkpoint(self.checkpoint_key, resume_at)
+
+    def finish(self):
+        if self.executor is not None:
+            self._collect(ALL_COMPLETED)
+            self.executor.shutdown()
+        if self.cache is not None and self.checkpoint_key:
+            self._checkpoint()
+        if self.owns_sink:
+            self.sink.close()
+        else:
+            self.sink.flush()
+        if self.cache is not None:
+            self.cache.close()
+        return self.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render HTML pages from a WARC file into Markdown files')
+    parser.add_argument('warc_file', help='Path to the input WARC or WARC.GZ file')
+    parser.add_argument('--output-dir', '--output', '-o', dest='output',
+                        help='Directory (or file, for packed formats) to write to (default: markdown_pages[.<format>])')
+    parser.add_argument('--format', '-f', dest='output_format', choices=OUTPUT_FORMATS, default='files',
+                        help='files: one .md file per page (default); jsonl.zst, zip, parquet: all pages in one file')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Number of processes converting pages (default: 1)')
+    parser.add_argument('--cache', help='SQLite file caching converted Markdown by payload digest and storing resume checkpoints')
+    parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint of an earlier run (requires --cache)')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+
+    if args.resume and not args.cache:
+        parser.error('--resume requires --cache')
+
+    output = args.output or OUTPUT_FORMATS[args.output_format][1]
+    cache = MarkdownCache(args.cache) if args.cache else None
+    checkpoint_key = os.path.abspath(args.warc_file) if cache else None
+    start = cache.get_checkpoint(checkpoint_key) if args.resume else 0
+    if start:
+        print(f"Resuming {args.warc_file} at offset {start}")
+
+    try:
+        exporter = MarkdownExporter(output, workers=args.workers, cache=cache, checkpoint_key=checkpoint_key,
+                                    output_format=args.output_format)
+    except FileExistsError as e:
+        parser.error(str(e))
+    count, = scan_filtered(args.warc_file, [exporter], filter_from_args(args), use_index=not args.no_index, start=start)
+
+    print(f"Extracted and converted {count} HTML pages to Markdown in '{output}'")
+    if cache:
+        print(f"Pages served from the conversion cache: {exporter.cache_hits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,67 +9,434 @@ and writes records into an output WARC using warcio.warcwriter.WARCWriter.
 
 Usage:
     python merge_warcs.py /path/to/warcs output.warc.gz
+    python merge_warcs.py /path/to/warcs output.warc.gz --raw
+    python merge_warcs.py /path/to/warcs out/merged.warc.gz --max-size 10G --workers 8
 
 Notes:
 - Input files ending with .gz are opened with gzip so compressed WARCs are
   supported.
 - The script preserves original records, including WARC headers. If you need
   to re-assign WARC-Record-IDs or normalize headers, modify the copying logic.
+- With --raw, inputs that are already gzipped per record are copied gzip
+  member by gzip member without recompression. Only the WARC header at the
+  start of each member is inflated; the member end is located from the gzip
+  trailer's size field, which must match the record size. Plain .warc files and
+  whole-file gzipped inputs fall back to re-encoding through WARCWriter.
+- With --max-size, output is rotated into merged-00001.warc.gz, ... shards,
+  cut at record boundaries once the bytes written reach the limit. With
+  --workers, inputs are grouped by size into tasks merged in parallel, each
+  rotating its own output; merged-manifest.csv maps each input to its shards.
+- With --dedup, responses whose WARC-Payload-Digest was already seen are
+  written as revisit records pointing at the first capture. Seen digests are
+  kept in an on-disk SQLite index (see warc_dedup.py).
 """
 
 from __future__ import annotations
 import os
 import argparse
+import csv
 import gzip
+import io
+import re
 import sys
-from typing import List
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from warc_dedup import DigestIndex, write_revisit
+from warc_scan import find_warc_files
 
 try:
     from warcio.archiveiterator import ArchiveIterator
     from warcio.warcwriter import WARCWriter
+    from warcio.statusandheaders import StatusAndHeadersParser
 except Exception as e:
     print("Required package 'warcio' is not installed. Install with: pip install warcio", file=sys.stderr)
     raise
 
+GZIP_MAGIC = b'\x1f\x8b'
+COPY_CHUNK_SIZE = 1024 * 1024
+# Enough decompressed bytes to hold the WARC header block of a record
+HEADER_PROBE_SIZE = 64 * 1024
+# Compressed bytes fed at a time while inflating a member's WARC header
+HEAD_FEED_SIZE = 16 * 1024
+# Gzip magic and the deflate method byte that start every member
+MEMBER_START = GZIP_MAGIC + b'\x08'
+# Gzip header (with optional name and comment fields) and trailer bytes
+MEMBER_OVERHEAD = 64 * 1024
+# Allowance for the WARC header and gzip framing of a record when rotating shards
+RECORD_OVERHEAD = 4 * 1024
+CONTENT_LENGTH_RE = re.compile(rb'\r\nContent-Length:\s*(\d+)', re.IGNORECASE)
+WARC_HEADER_PARSER = StatusAndHeadersParser(['WARC/1.0', 'WARC/1.1', 'WARC/0.17', 'WARC/0.18'])
+HTTP_HEADER_PARSER = StatusAndHeadersParser(['HTTP/1.0', 'HTTP/1.1'])
+
+
+class NotPerRecordGzip(Exception):
+    """Raised when a gzip member does not hold exactly one WARC record."""
+
+
+def _expected_member_size(head: bytes) -> Optional[int]:
+    """Return the decompressed size of a member holding one record with this header."""
+    header_end = head.find(b'\r\n\r\n')
+    if not head.startswith(b'WARC/') or header_end == -1:
+        return None
+    match = CONTENT_LENGTH_RE.search(head, 0, header_end)
+    if not match:
+        return None
+    # header block + blank line + content block + trailing CRLF CRLF
+    return header_end + 4 + int(match.group(1)) + 4
+
+
+def _trailer_matches(buf: bytearray, end: int, expected: int) -> bool:
+    """Whether the gzip trailer ending at `end` records `expected` uncompressed bytes (ISIZE, mod 2**32)."""
+    return int.from_bytes(buf[end - 4:end], 'little') == expected & 0xFFFFFFFF
+
+
+def copy_gzip_members(in_f, out_f, on_header: Optional[Callable[[bytes], bool]] = None,
+                      reserve: Optional[Callable[[int], None]] = None) -> int:
+    """Copy the gzip members of `in_f` to `out_f` byte for byte.
+
+    Only the start of each member is inflated, up to HEADER_PROBE_SIZE bytes,
+    to read the WARC header and the record size it implies. The rest of the
+    member is not inflated: its end is the next gzip member start, or the end
+    of the file, right after a gzip trailer whose ISIZE equals that record
+    size. Nothing is recompressed. Raises NotPerRecordGzip on the first
+    member that does not hold exactly one WARC record or is cut off at the
+    end of the file; data already written to `out_f` is left for the caller
+    to discard. Returns the number of members handled.
+
+    If `on_header` is given it is called with the first decompressed bytes of
+    every member once its WARC header is complete. When it returns False the
+    member is not copied (the callback has written a replacement).
+    `reserve`, if given, is called with the record size of every member
+    before anything of it (or its replacement) is written.
+    """
+    members = 0
+    # Compressed bytes from the start of the current member (or its unwritten part)
+    buf = bytearray()
+
+    def fill() -> bool:
+        data = in_f.read(COPY_CHUNK_SIZE)
+        buf.extend(data)
+        return bool(data)
+
+    while buf or fill():
+        decompressor = zlib.decompressobj(31)
+        head = b''
+        fed = 0
+        while len(head) < HEADER_PROBE_SIZE and not decompressor.eof:
+            if fed == len(buf) and not fill():
+                raise NotPerRecordGzip(f"gzip member {members} is truncated at end of file")
+            chunk = bytes(buf[fed:fed + HEAD_FEED_SIZE])
+            head += decompressor.decompress(chunk, HEADER_PROBE_SIZE - len(head))
+            fed += len(chunk) - len(decompressor.unconsumed_tail)
+
+        expected = _expected_member_size(head)
+        if expected is None or expected < len(head) or (decompressor.eof and expected != len(head)):
+            raise NotPerRecordGzip(f"gzip member {members} does not hold exactly one WARC record")
+        if reserve is not None:
+            reserve(expected)
+        keep = on_header(head) if on_header else True
+
+        if decompressor.eof:
+            end = fed - len(decompressor.unused_data)
+        else:
+            # Deflate never grows data by more than a few bytes per block, so
+            # a longer member must hold more than the record (whole-file gzip)
+            limit = expected + expected // 1000 + MEMBER_OVERHEAD
+            flushed = 0
+            pos = fed
+            end = None
+            while end is None:
+                idx = buf.find(MEMBER_START, pos)
+                if idx != -1:
+                    if flushed + idx >= 18 and _trailer_matches(buf, idx, expected):
+                        end = idx
+                    pos = idx + 1
+                else:
+                    pos = max(pos, len(buf) - len(MEMBER_START) + 1)
+                    # Copy all but the bytes a trailer and member start may still need
+                    cut = max(pos - 8, 0)
+                    if keep:
+                        out_f.write(buf[:cut])
+                    del buf[:cut]
+                    flushed += cut
+                    pos -= cut
+                    if not fill():
+                        if not _trailer_matches(buf, len(buf), expected):
+                            raise NotPerRecordGzip(f"gzip member {members} is truncated at end of file")
+                        end = len(buf)
+                if end is None and flushed + pos > limit:
+                    raise NotPerRecordGzip(f"gzip member {members} holds more than one WARC record")
+
+        if keep:
+            out_f.write(buf[:end])
+        del buf[:end]
+        members += 1
+    return members
 
-def find_warc_files(input_dir: str) -> List[str]:
-    """Recursively find files that look like WARC files in input_dir.
 
-    Matches case-insensitively on .warc and .warc.gz.
+def _dedup_member_header(head: bytes, writer: WARCWriter, index: DigestIndex) -> bool:
+    """`on_header` callback for raw copies: replace duplicate responses by revisits."""
+    stream = io.BytesIO(head)
+    rec_headers = WARC_HEADER_PARSER.parse(stream)
+    digest = rec_headers.get_header('WARC-Payload-Digest')
+    if rec_headers.get_header('WARC-Type') != 'response' or not digest:
+        return True
+    # Copy the member if its HTTP headers did not fit into the probe
+    if head.find(b'\r\n\r\n', stream.tell()) == -1:
+        return True
+
+    uri = rec_headers.get_header('WARC-Target-URI')
+    date = rec_headers.get_header('WARC-Date')
+    original = index.lookup_or_add(digest, uri, date)
+    if original is None:
+        return True
+    write_revisit(writer, uri, date, digest, original, http_headers=HTTP_HEADER_PARSER.parse(stream))
+    return False
+
+
+def reencode_records(fpath: str, output: 'ShardedOutput', index: Optional[DigestIndex] = None) -> int:
+    """Re-serialise and recompress every record of `fpath` into `output`.
+
+    With `index`, responses whose payload digest was seen before are written
+    as revisit records.
     """
-    matches: List[str] = []
-    for root, _, files in os.walk(input_dir):
-        for name in files:
-            lname = name.lower()
-            if lname.endswith('.warc') or lname.endswith('.warc.gz'):
-                matches.append(os.path.join(root, name))
-    matches.sort()
-    return matches
+    records = 0
+    opener = gzip.open if fpath.lower().endswith('.gz') else open
+    with opener(fpath, 'rb') as in_f:
+        # Output position after the last complete record
+        mark = output.mark()
+        try:
+            for record in ArchiveIterator(in_f):
+                output.reserve(record.length or 0)
+                writer = output.writer
+                digest = record.rec_headers.get_header('WARC-Payload-Digest')
+                uri = record.rec_headers.get_header('WARC-Target-URI')
+                date = record.rec_headers.get_header('WARC-Date')
+                original = None
+                if index is not None and record.rec_type == 'response' and digest:
+                    original = index.lookup_or_add(digest, uri, date)
+                if original is not None:
+                    write_revisit(writer, uri, date, digest, original, http_headers=record.http_headers)
+                else:
+                    # write_record accepts the record yielded by ArchiveIterator
+                    writer.write_record(record)
+                records += 1
+                mark = output.mark()
+        except Exception as exc:
+            print(f"Warning: failed to read records from {fpath}: {exc}", file=sys.stderr)
+            # Drop a record that was being written when the input broke off
+            output.rollback(mark)
+    return records
+
+
+def is_gzip_file(fpath: str) -> bool:
+    with open(fpath, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+class ShardedOutput:
+    """Gzipped WARC output that moves on to a new file at record boundaries.
+
+    Files are named by `path_for(1)`, `path_for(2)`, ... Before each record
+    `reserve(size)` is called with its uncompressed record size; when that
+    many more bytes could push a non-empty file past `max_size`, the next
+    file is started first. Compressed records are practically never larger
+    than that size, so files only exceed `max_size` when a single record
+    does. Without `max_size` everything goes to `path_for(1)`.
+    """
+
+    def __init__(self, path_for: Callable[[int], str], max_size: Optional[int] = None) -> None:
+        self.path_for = path_for
+        self.max_size = max_size
+        self.paths: List[str] = []
+        # output path -> records written to it
+        self.records: Dict[str, int] = {}
+        self._open(self.path_for(1), 'wb')
+
+    def _open(self, path: str, mode: str) -> None:
+        if path not in self.records:
+            self.paths.append(path)
+            self.records[path] = 0
+        self.out_f = open(path, mode)
+        self.writer = WARCWriter(self.out_f, gzip=True)
+
+    @property
+    def path(self) -> str:
+        return self.paths[-1]
+
+    def write(self, data: bytes) -> None:
+        self.out_f.write(data)
+
+    def reserve(self, size: int) -> None:
+        size += size // 1000 + RECORD_OVERHEAD
+        written = self.out_f.tell()
+        if self.max_size and written and written + size > self.max_size:
+            self.out_f.close()
+            self._open(self.path_for(len(self.paths) + 1), 'wb')
+        self.records[self.path] += 1
+
+    def mark(self) -> Tuple[int, int, Dict[str, int]]:
+        return len(self.paths), self.out_f.tell(), dict(self.records)
+
+    def rollback(self, mark: Tuple[int, int, Dict[str, int]]) -> None:
+        """Drop everything written since `mark()`, including files started since."""
+        count, position, records = mark
+        self.out_f.close()
+        while len(self.paths) > count:
+            os.remove(self.paths.pop())
+        self.records = dict(records)
+        self._open(self.path, 'r+b')
+        self.out_f.seek(position)
+        self.out_f.truncate()
 
+    def close(self) -> None:
+        self.out_f.close()
 
-def merge_warcs(input_dir: str, output_path: str) -> None:
+
+def merge_files(files: List[str], path_for: Callable[[int], str], raw: bool = False, label: str = '',
+                dedup_index: Optional[str] = None, max_size: Optional[int] = None) -> List[Tuple[str, str, int]]:
+    """Merge `files` in order into `path_for(1)`, rotating to `path_for(2)`, ... at `max_size`.
+
+    With `dedup_index` (path to a DigestIndex), duplicate payloads are written
+    as revisit records. Returns `(input_path, output_path, records_written)`
+    for every input and output file it went to, in order.
+    """
+    written: List[Tuple[str, str, int]] = []
+    index = DigestIndex(dedup_index) if dedup_index else None
+    output = ShardedOutput(path_for, max_size)
+    on_header = (lambda head: _dedup_member_header(head, output.writer, index)) if index is not None else None
+
+    for idx, fpath in enumerate(files, start=1):
+        print(f"{label}[{idx}/{len(files)}] Reading: {fpath}", flush=True)
+        mark = output.mark()
+        copied = False
+        if raw and is_gzip_file(fpath):
+            try:
+                with open(fpath, 'rb') as in_f:
+                    copy_gzip_members(in_f, output, on_header=on_header, reserve=output.reserve)
+                copied = True
+            except (NotPerRecordGzip, zlib.error) as exc:
+                print(f"{label}  not per-record gzipped ({exc}), re-encoding", file=sys.stderr, flush=True)
+                output.rollback(mark)
+                if index is not None:
+                    # Digests from the aborted copy would mark records as their own duplicates
+                    index.rollback()
+        if not copied:
+            reencode_records(fpath, output, index=index)
+        if index is not None:
+            index.commit()
+
+        before = mark[2]
+        for path in output.paths[mark[0] - 1:]:
+            written.append((fpath, path, output.records[path] - before.get(path, 0)))
+
+    output.close()
+    if index is not None:
+        index.close()
+    return written
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as `500M` or `10G` into bytes."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*', value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit.upper() or ' '))
+
+
+def plan_shards(files: List[str], max_size: int) -> List[List[str]]:
+    """Group consecutive input files into tasks of at most `max_size` input bytes.
+
+    Inputs larger than `max_size` get a task of their own. Each task is merged
+    by one worker, which rotates its output at `max_size` written bytes.
+    """
+    shards: List[List[str]] = []
+    current: List[str] = []
+    current_size = 0
+    for fpath in files:
+        size = os.path.getsize(fpath)
+        if current and current_size + size > max_size:
+            shards.append(current)
+            current, current_size = [], 0
+        current.append(fpath)
+        current_size += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def shard_path(output_path: str, number: int) -> str:
+    """`merged.warc.gz` -> `merged-00001.warc.gz`."""
+    base = re.sub(r'\.warc(\.gz)?$', '', output_path, flags=re.IGNORECASE)
+    return f"{base}-{number:05d}.warc.gz"
+
+
+def part_path(output_path: str, task: int, number: int) -> str:
+    """`merged.warc.gz` -> `merged-00001.part001.warc.gz`, renamed to a shard when all tasks are done."""
+    base = re.sub(r'\.warc(\.gz)?$', '', output_path, flags=re.IGNORECASE)
+    return f"{base}-{task:05d}.part{number:03d}.warc.gz"
+
+
+def _merge_shard(task: Tuple[List[str], str, int, bool, Optional[str], int]) -> List[Tuple[str, str, int]]:
+    files, output_path, number, raw, dedup_index, max_size = task
+    return merge_files(files, lambda n: part_path(output_path, number, n), raw=raw,
+                       label=f"{os.path.basename(shard_path(output_path, number))} ",
+                       dedup_index=dedup_index, max_size=max_size)
+
+
+def merge_warcs_sharded(files: List[str], output_path: str, max_size: int,
+                        raw: bool = False, workers: int = 1, dedup_index: Optional[str] = None) -> None:
+    """Merge `files` into rotated shards, plus a manifest.
+
+    Shards are cut at record boundaries once they reach `max_size` bytes
+    written. With several workers the inputs are first grouped into tasks of
+    about `max_size` input bytes, each merged (and rotated) by one process,
+    so the last shard of a task may be smaller. The manifest
+    (`<output>-manifest.csv`) maps each input to the shards it went to.
+    """
+    groups = plan_shards(files, max_size) if workers > 1 else [files]
+    tasks = [(group, output_path, n, raw, dedup_index, max_size) for n, group in enumerate(groups, start=1)]
+    print(f"Merging {len(files)} files in {len(tasks)} task(s) with {workers} worker(s)", flush=True)
+
+    total_records = 0
+    shards: Dict[str, str] = {}
+    manifest_path = re.sub(r'\.warc(\.gz)?$', '', output_path, flags=re.IGNORECASE) + '-manifest.csv'
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(manifest_path, 'w', newline='', encoding='utf-8') as manifest_f:
+        manifest = csv.writer(manifest_f)
+        manifest.writerow(['input', 'shard', 'records'])
+        # map() yields tasks in order, so shards are numbered and the
+        # manifest written in input order
+        for written in executor.map(_merge_shard, tasks):
+            for fpath, part, records in written:
+                if part not in shards:
+                    shards[part] = shard_path(output_path, len(shards) + 1)
+                    os.replace(part, shards[part])
+                    print(f"Finished shard: {shards[part]} ({os.path.getsize(shards[part])} bytes)")
+                manifest.writerow([fpath, shards[part], records])
+                total_records += records
+
+    print(f"Done. Wrote {total_records} records into {len(shards)} shards, manifest: {manifest_path}")
+
+
+def merge_warcs(input_dir: str, output_path: str, raw: bool = False,
+                max_size: Optional[int] = None, workers: int = 1,
+                dedup_index: Optional[str] = None) -> None:
     files = find_warc_files(input_dir)
     if not files:
         print(f"No .warc or .warc.gz files found in {input_dir}")
         return
 
-    total_records = 0
-    print(f"Merging {len(files)} files into: {output_path}")
+    if max_size:
+        merge_warcs_sharded(files, output_path, max_size, raw=raw, workers=workers, dedup_index=dedup_index)
+        return
 
-    with open(output_path, 'wb') as out_f:
-        writer = WARCWriter(out_f, gzip=True)
-
-        for idx, fpath in enumerate(files, start=1):
-            print(f"[{idx}/{len(files)}] Reading: {fpath}")
-            opener = gzip.open if fpath.lower().endswith('.gz') else open
-            with opener(fpath, 'rb') as in_f:
-                try:
-                    for record in ArchiveIterator(in_f):
-                        # write_record accepts the record yielded by ArchiveIterator
-                        writer.write_record(record)
-                        total_records += 1
-                except Exception as exc:
-                    print(f"Warning: failed to read records from {fpath}: {exc}", file=sys.stderr)
+    print(f"Merging {len(files)} files into: {output_path}")
+    written = merge_files(files, lambda n: output_path, raw=raw, dedup_index=dedup_index)
+    total_records = sum(records for _, _, records in written)
 
     print(f"Done. Wrote {total_records} records into {output_path}")
 
@@ -78,6 +445,32 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Merge .warc and .warc.gz files into one warc.gz')
     parser.add_argument('input_dir', help='Directory containing .warc or .warc.gz files')
     parser.add_argument('output_file', help='Output WARC file (e.g., merged.warc.gz)')
+    parser.add_argument('--raw', action='store_true',
+                        help='Copy gzip members of per-record gzipped inputs without recompressing them')
+    parser.add_argument('--max-size', type=parse_size,
+                        help='Rotate output into shards (merged-00001.warc.gz, ...) of at most this size, e.g. 10G; '
+                             'inputs are split between shards at record boundaries')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Number of shards written in parallel with --max-size (default: 1)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Write responses whose payload digest was seen before as revisit records')
+    parser.add_argument('--dedup-index',
+                        help='SQLite payload digest index to use and update (default: <output_file>.dedup.sqlite)')
     args = parser.parse_args()
 
-    merge_warcs(args.input_dir, args.output_file)
+    if args.workers > 1 and not args.max_size:
+        parser.error('--workers requires --max-size')
+
+    dedup_index = None
+    if args.dedup or args.dedup_index:
+        dedup_index = args.dedup_index or args.output_file + '.dedup.sqlite'
+    if dedup_index and args.workers > 1:
+        parser.error('deduplication needs a single ordered pass and cannot be combined with --workers')
+    if dedup_index and not args.dedup_index and os.path.exists(dedup_index):
+        # The output is written anew, so digests of an earlier run would point
+        # revisits at records that no longer exist
+        print(f"Removing digest index of an earlier run: {dedup_index}")
+        os.remove(dedup_index)
+
+    merge_warcs(args.input_dir, args.output_file, raw=args.raw,
+                max_size=args.max_size, workers=args.workers, dedup_index=dedup_index)
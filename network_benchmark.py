@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""network_benchmark.py
+
+Measure the network scripts against a local `wayback_replay_server.py`
+instead of the live Wayback Machine.
+
+Starts a replay server in the background, runs `ia_stats_fetcher.py` and
+`nick-com-helpers/fill_nick_msgboards_your_world.py` against it as
+subprocesses and reports, per run, the wall time, the requests the server
+answered (requests/sec, 429s, injected 503s), the TCP connections the
+script opened and a check of its output.
+
+By default a synthetic archive is served (`--sites`, `--captures`,
+`--boards`, `--threads` set its size) and the outputs are checked against
+what it contains. With `--cdx`/`--pages` recordings are replayed instead;
+`--sites-csv` and `--boards-json` then give the script inputs (board links
+are rewritten to point at the local server).
+
+Usage:
+    python network_benchmark.py
+    python network_benchmark.py --latency 0.05 --error-rate 0.02 --max-concurrent 8 --repeat 3
+    python network_benchmark.py --only ia --ia-args "--parallel --workers 16 --rate 0"
+    python network_benchmark.py --cdx recorded.json --sites-csv urls.csv --only ia
+"""
+
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from wayback_replay_server import (CDX_PATH, ReplayServer, add_server_arguments, load_archive, server_options,
+                                   start_server, synthetic_archive)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IA_SCRIPT = os.path.join(HERE, 'ia_stats_fetcher.py')
+NICK_SCRIPT = os.path.join(HERE, 'nick-com-helpers', 'fill_nick_msgboards_your_world.py')
+DEFAULT_IA_ARGS = '--parallel --workers 8 --rate 0'
+DEFAULT_NICK_ARGS = '--rate 0'
+
+# (command, output check) for one run; the check returns a short summary
+Job = Tuple[List[str], Callable[[], str]]
+
+
+def write_sites_csv(path: str, sites: List[str]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['url'])
+        writer.writerows([site] for site in sites)
+
+
+def write_boards_json(path: str, base_url: str, board_paths: List[str]) -> None:
+    """Two entries (crawl dates) per board, as in the real dataset, so the board cache is exercised."""
+    entries = []
+    for i, board_path in enumerate(board_paths):
+        for day in (1, 15):
+            entries.append({'board_name': f'Board {i}', 'board_link': base_url + board_path, 'board_id': i,
+                            'year': 2004, 'month': 1, 'day': day, 'source_url': base_url + '/web/20040101000000/'})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2)
+
+
+def rebase_boards_json(source: str, path: str, base_url: str) -> None:
+    """Copy a boards JSON, pointing every board link at the local server."""
+    with open(source, encoding='utf-8') as f:
+        entries = json.load(f)
+    for entry in entries:
+        parts = urlsplit(entry['board_link'])
+        entry['board_link'] = base_url + parts.path + (f'?{parts.query}' if parts.query else '')
+        entry.pop('has_playback', None)
+        entry.pop('has_msg_content', None)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2)
+
+
+def check_ia_output(path: str, expected_sites: int) -> str:
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    presence = [row['Presence in internet archive'] for row in rows]
+    summary = f"{presence.count('Yes')}/{expected_sites} sites found, {presence.count('Error')} errors"
+    return summary if len(rows) == expected_sites else summary + f' ({len(rows)} rows!)'
+
+
+def check_nick_output(path: str, expected: Optional[Tuple[int, int]]) -> str:
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    playback = sum(1 for e in entries if e.get('has_playback'))
+    content = sum(1 for e in entries if e.get('has_msg_content'))
+    summary = f"{playback}/{len(entries)} with playback, {content} with content"
+    if expected is not None and (playback, content) != expected:
+        summary += f' (expected {expected[0]} and {expected[1]}!)'
+    return summary
+
+
+def run(name: str, job: Job, server: ReplayServer, log_path: str) -> Dict[str, object]:
+    command, check = job
+    before = server.snapshot()
+    started = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, cwd=HERE)
+    wall = time.perf_counter() - started
+    after = server.snapshot()
+
+    statuses = {code: after['statuses'].get(code, 0) - before['statuses'].get(code, 0) for code in after['statuses']}
+    requests = after['requests'] - before['requests']
+    result = {'script': name, 'wall': wall, 'requests': requests, 'rps': requests / wall if wall > 0 else 0.0,
+              'throttled': statuses.get(429, 0), 'errors': statuses.get(503, 0),
+              'connections': after['connections'] - before['connections']}
+    if returncode != 0:
+        with open(log_path, encoding='utf-8', errors='replace') as log:
+            tail = log.read()[-2000:]
+        result['check'] = f'exit code {returncode}'
+        print(f"{name} failed with exit code {returncode}:\n{tail}", file=sys.stderr)
+    else:
+        result['check'] = check()
+    return result
+
+
+def print_results(results: List[Dict[str, object]]) -> None:
+    print(f"\n{'Script':<20} {'Wall s':>8} {'Requests':>9} {'Req/s':>8} {'429':>6} {'503':>6} {'Conns':>6}  Output")
+    for r in results:
+        print(f"{r['script']:<20} {r['wall']:>8.2f} {r['requests']:>9} {r['rps']:>8.1f} {r['throttled']:>6} "
+              f"{r['errors']:>6} {r['connections']:>6}  {r['check']}")
+    by_script: Dict[str, List[float]] = {}
+    for r in results:
+        by_script.setdefault(r['script'], []).append(r['wall'])
+    if any(len(walls) > 1 for walls in by_script.values()):
+        print()
+        for script, walls in by_script.items():
+            print(f"{script:<20} median wall time {median(walls):.2f} s over {len(walls)} runs")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the network scripts against a local replay server')
+    add_server_arguments(parser)
+    parser.add_argument('--sites', type=int, default=30, help='Synthetic sites for ia_stats_fetcher.py (default: 30)')
+    parser.add_argument('--captures', type=int, default=5000,
+                        help='Base CDX rows per synthetic site; sites have 1-3 times as many (default: 5000)')
+    parser.add_argument('--boards', type=int, default=40, help='Synthetic message boards (default: 40)')
+    parser.add_argument('--threads', type=int, default=5, help='Threads per synthetic board (default: 5)')
+    parser.add_argument('--sites-csv', help='Site list for ia_stats_fetcher.py when replaying recordings')
+    parser.add_argument('--boards-json', help='Boards JSON for fill_nick_msgboards_your_world.py when replaying recordings')
+    parser.add_argument('--only', choices=['ia', 'nick'], help='Only benchmark one script')
+    parser.add_argument('--ia-args', default=DEFAULT_IA_ARGS,
+                        help=f'Extra arguments for ia_stats_fetcher.py (default: "{DEFAULT_IA_ARGS}")')
+    parser.add_argument('--nick-args', default=DEFAULT_NICK_ARGS,
+                        help='Extra arguments for fill_nick_msgboards_your_world.py')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per script (default: 1)')
+    args = parser.parse_args(argv)
+
+    recorded = bool(args.cdx or args.pages)
+    if recorded:
+        archive = load_archive(args)
+        sites = board_paths = None
+        expected_boards = None
+    else:
+        archive, sites, board_paths = synthetic_archive(args.sites, args.captures, args.boards, args.threads,
+                                                        seed=args.seed or 0)
+        playback = sum(1 for b in range(args.boards) if b % 5 != 0)
+        content = sum(1 for b in range(args.boards) if b % 5 not in (0, 1))
+        expected_boards = (2 * playback, 2 * content)
+        print(f"Synthetic archive: {len(archive.rows)} CDX rows for {len(sites)} sites, "
+              f"{len(board_paths)} boards with {args.threads} threads each")
+
+    server = start_server(archive, **server_options(args))
+    print(f"Replay server on {server.url}")
+
+    with tempfile.TemporaryDirectory(prefix='network_benchmark_') as tmp:
+        jobs: List[Tuple[str, Callable[[int], Job]]] = []
+
+        if args.only in (None, 'ia') and (sites or args.sites_csv):
+            sites_csv = args.sites_csv
+            if sites_csv is None:
+                sites_csv = os.path.join(tmp, 'sites.csv')
+                write_sites_csv(sites_csv, sites)
+            with open(sites_csv, newline='', encoding='utf-8') as f:
+                site_count = sum(1 for row in csv.reader(f) if row and row[0].strip()) - 1
+
+            def ia_job(n: int) -> Job:
+                output = os.path.join(tmp, f'ia_stats_{n}.csv')
+                command = [sys.executable, IA_SCRIPT, sites_csv, output,
+                           '--cdx-api', server.url + CDX_PATH] + shlex.split(args.ia_args)
+                return command, lambda: check_ia_output(output, site_count)
+            jobs.append(('ia_stats_fetcher', ia_job))
+
+        if args.only in (None, 'nick') and (board_paths or args.boards_json):
+            boards_json = os.path.join(tmp, 'boards.json')
+            if args.boards_json:
+                rebase_boards_json(args.boards_json, boards_json, server.url)
+            else:
+                write_boards_json(boards_json, server.url, board_paths)
+
+            def nick_job(n: int) -> Job:
+                output = os.path.join(tmp, f'boards_filled_{n}.json')
+                command = [sys.executable, NICK_SCRIPT, '--input', boards_json,
+                           '--output', output] + shlex.split(args.nick_args)
+                return command, lambda: check_nick_output(output, expected_boards)
+            jobs.append(('fill_nick_msgboards', nick_job))
+
+        if not jobs:
+            parser.error('nothing to benchmark: give --sites-csv and/or --boards-json with recordings')
+
+        results = []
+        for n in range(args.repeat):
+            for name, make_job in jobs:
+                print(f"Running {name} ({n + 1}/{args.repeat})...", flush=True)
+                results.append(run(name, make_job(n), server, os.path.join(tmp, f'{name}_{n}.log')))
+
+    server.shutdown()
+    print_results(results)
+    return 1 if any(str(r['check']).startswith('exit code') for r in results) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
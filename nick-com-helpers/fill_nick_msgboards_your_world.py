@@ -2,21 +2,124 @@
 
 import argparse
 import html
+import http.client
 import json
 import re
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 
 
 NEVER_HARVESTED_MARKER = 'Url has never been harvested:'
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+DEFAULT_RATE = 10.0  # requests per second per host
+DEFAULT_TIMEOUT = 20
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+HEADERS = {'User-Agent': 'fill_nick_msgboards_your_world/1.0 (+urllib keep-alive)'}
 
 
-def fetch_text(url: str, timeout: int = 20) -> str:
-    with urllib.request.urlopen(url, timeout=timeout) as response:
-        return response.read().decode('utf-8', 'ignore')
+class HostPool:
+    """Keep-alive connections, a concurrency cap and a rate limit per host, shared by all workers.
+
+    At most `per_host` requests to one host run at a time, each on an idle
+    pooled connection when there is one, and requests to a host start at
+    least 1/`rate` seconds apart. Errors are raised as `urllib.error.HTTPError`,
+    `urllib.error.URLError` or `TimeoutError`, like `urllib.request.urlopen`.
+    """
+
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, rate: float = DEFAULT_RATE,
+                 timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.per_host = max(1, per_host)
+        self.rate = rate
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.slots: dict[str, threading.BoundedSemaphore] = {}
+        self.idle: dict[str, list[http.client.HTTPConnection]] = {}
+        self.next_start: dict[str, float] = {}
+        self.requests = 0
+        self.connections = 0
+
+    @contextmanager
+    def _slot(self, host: str):
+        with self.lock:
+            slot = self.slots.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with slot:
+            if self.rate > 0:
+                with self.lock:
+                    now = time.monotonic()
+                    start = max(now, self.next_start.get(host, 0.0))
+                    self.next_start[host] = start + 1 / self.rate
+                if start > now:
+                    time.sleep(start - now)
+            yield
+
+    def _checkout(self, host: str, parts: urllib.parse.SplitResult) -> tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if self.idle.get(host):
+                return self.idle[host].pop(), True
+            self.connections += 1
+        cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        return cls(parts.netloc, timeout=self.timeout), False
+
+    def _checkin(self, host: str, conn: http.client.HTTPConnection) -> None:
+        with self.lock:
+            self.idle.setdefault(host, []).append(conn)
+
+    def _request(self, url: str) -> tuple[int, str, http.client.HTTPMessage, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise urllib.error.URLError(f'unsupported URL: {url}')
+        host = f'{parts.scheme}://{parts.netloc}'
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        with self._slot(host):
+            for attempt in (0, 1):
+                conn, reused = self._checkout(host, parts)
+                try:
+                    conn.request('GET', target, headers=HEADERS)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    # The server may have closed an idle keep-alive connection: retry once on a new one
+                    if reused and attempt == 0 and isinstance(e, (ConnectionResetError, BrokenPipeError,
+                                                                  http.client.RemoteDisconnected)):
+                        continue
+                    if isinstance(e, TimeoutError):
+                        raise
+                    raise urllib.error.URLError(e) from e
+                with self.lock:
+                    self.requests += 1
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._checkin(host, conn)
+                return response.status, response.reason, response.headers, body
+
+    def fetch_text(self, url: str) -> str:
+        for _ in range(MAX_REDIRECTS + 1):
+            status, reason, headers, body = self._request(url)
+            if status in REDIRECT_STATUSES and headers.get('Location'):
+                url = urllib.parse.urljoin(url, headers['Location'])
+                continue
+            if status >= 400:
+                raise urllib.error.HTTPError(url, status, reason, headers, None)
+            return body.decode('utf-8', 'ignore')
+        raise urllib.error.URLError(f'too many redirects: {url}')
+
+    def close(self) -> None:
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
 
 
 def is_never_harvested(text: str) -> bool:
@@ -47,23 +150,47 @@ def _log(msg: str) -> None:
     print(msg, flush=True)
 
 
-def has_msg_content(board_url: str, board_text: str) -> bool:
+def has_msg_content(board_url: str, board_text: str, pool: HostPool, log) -> bool:
     thread_urls = extract_thread_links(board_url, board_text)
     for i, thread_url in enumerate(thread_urls, 1):
-        _log(f"    thread {i}/{len(thread_urls)}: {thread_url}")
+        log(f"    thread {i}/{len(thread_urls)}: {thread_url}")
         try:
-            thread_text = fetch_text(thread_url)
+            thread_text = pool.fetch_text(thread_url)
         except (urllib.error.HTTPError, urllib.error.URLError, TimeoutError) as e:
-            _log(f"      -> fetch error: {e}")
+            log(f"      -> fetch error: {e}")
             continue
         if not is_never_harvested(thread_text):
-            _log(f"      -> has content")
+            log(f"      -> has content")
             return True
-        _log(f"      -> never harvested")
+        log(f"      -> never harvested")
     return False
 
 
-def fill_entries(entries: list[dict]) -> int:
+def probe_board(board_url: str, pool: HostPool) -> tuple[bool, bool, list[str]]:
+    """Return `(has_playback, has_msg_content, log lines)` for one board.
+
+    Threads are probed one after another and stop at the first one with
+    content; boards are what runs concurrently.
+    """
+    lines: list[str] = []
+    try:
+        board_text = pool.fetch_text(board_url)
+        playback = not is_never_harvested(board_text)
+        if playback:
+            lines.append(f"  board reachable, checking threads for content...")
+            msg_content = has_msg_content(board_url, board_text, pool, lines.append)
+        else:
+            msg_content = False
+            lines.append(f"  board never harvested")
+    except (urllib.error.HTTPError, urllib.error.URLError, TimeoutError) as e:
+        lines.append(f"  fetch error: {e}")
+        playback = False
+        msg_content = False
+    lines.append(f"  -> has_playback={playback}, has_msg_content={msg_content}")
+    return playback, msg_content, lines
+
+
+def fill_entries(entries: list[dict], pool: HostPool, workers: int = DEFAULT_WORKERS) -> int:
     updated = 0
     board_cache: dict[str, tuple[bool, bool]] = {}
 
@@ -71,33 +198,26 @@ def fill_entries(entries: list[dict]) -> int:
     total = len(needs_update)
     _log(f"{len(entries)} total entries, {total} need updating, {len(entries) - total} already filled")
 
-    for idx, entry in enumerate(needs_update, 1):
-        board_url = entry['board_link']
-        _log(f"\n[{idx}/{total}] {board_url}")
+    # Every distinct board is probed once, however many entries share it
+    boards = list(dict.fromkeys(e['board_link'] for e in needs_update))
+    _log(f"{len(boards)} distinct boards to probe with {workers} workers")
 
-        if board_url in board_cache:
-            playback, msg_content = board_cache[board_url]
-            _log(f"  -> cached: has_playback={playback}, has_msg_content={msg_content}")
-        else:
-            try:
-                board_text = fetch_text(board_url)
-                playback = not is_never_harvested(board_text)
-                if playback:
-                    _log(f"  board reachable, checking threads for content...")
-                    msg_content = has_msg_content(board_url, board_text)
-                else:
-                    msg_content = False
-                    _log(f"  board never harvested")
-            except (urllib.error.HTTPError, urllib.error.URLError, TimeoutError) as e:
-                _log(f"  fetch error: {e}")
-                playback = False
-                msg_content = False
-            _log(f"  -> has_playback={playback}, has_msg_content={msg_content}")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(probe_board, board_url, pool): board_url for board_url in boards}
+        for idx, future in enumerate(as_completed(futures), 1):
+            board_url = futures[future]
+            playback, msg_content, lines = future.result()
+            # Each board's log is printed in one piece when it is done
+            _log(f"\n[{idx}/{len(boards)}] {board_url}")
+            for line in lines:
+                _log(line)
             board_cache[board_url] = (playback, msg_content)
 
-        entry['has_playback'] = playback
-        entry['has_msg_content'] = msg_content
+    for entry in needs_update:
+        entry['has_playback'], entry['has_msg_content'] = board_cache[entry['board_link']]
         updated += 1
+    if total > len(boards):
+        _log(f"\n{total - len(boards)} entries reused the result of a board probed for another entry")
 
     return updated
 
@@ -107,15 +227,30 @@ def main() -> int:
     parser.add_argument('--input', default='nick_msgboards_your_world.json')
     parser.add_argument('--output', default='nick_msgboards_your_world.json')
     parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Boards probed concurrently (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help=f'Maximum concurrent requests to one host (default: {DEFAULT_PER_HOST})')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help=f'Maximum requests per second to one host, 0 for no limit (default: {DEFAULT_RATE:g})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f'Seconds to wait for a response (default: {DEFAULT_TIMEOUT})')
     args = parser.parse_args()
 
     input_path = Path(args.input)
     output_path = Path(args.output)
 
     entries = json.loads(input_path.read_text())
-    updated = fill_entries(entries)
+    pool = HostPool(per_host=args.per_host, rate=args.rate, timeout=args.timeout)
+    started = time.monotonic()
+    try:
+        updated = fill_entries(entries, pool, workers=args.workers)
+    finally:
+        pool.close()
+    elapsed = time.monotonic() - started
 
     print(f'updated {updated} entries')
+    print(f'{pool.requests} requests over {pool.connections} connections in {elapsed:.1f}s')
     if not args.dry_run:
         output_path.write_text(json.dumps(entries, indent=2) + '\n')
 
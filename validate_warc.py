@@ -1,29 +1,90 @@
-import sys
-from warcio.archiveiterator import ArchiveIterator
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from warc_scan import DigestValidator, find_member_start, is_gzip_file, scan_warc
+from warc_summary_cache import SummaryCache
+
+# Smallest byte range handed to one worker in parallel mode
+MIN_RANGE_SIZE = 16 * 1024 * 1024
+
+
+def _validate_range(task):
+    """Validate the records whose gzip member starts inside one byte range.
+
+    A fatal read error counts as one failed record; for a .warc.gz the scan
+    then resumes at the next gzip member, so sequential and parallel runs
+    check the same records of a damaged file.
+    """
+    file_path, start, end, report = task
+    gzipped = is_gzip_file(file_path)
+    validator = DigestValidator(report=report)
+    with open(file_path, 'rb') as stream:
+        member_start = find_member_start(stream, start, end) if gzipped else start
+        while member_start is not None:
+            validator.next_offset = member_start
+            try:
+                scan_warc(file_path, [validator], start=member_start, end=end)
+                break
+            except Exception as e:
+                problem = f"Fatal error reading WARC: {e}"
+            if report:
+                print(f"Error in record {validator.count} (unknown): {problem}")
+            validator.failures.append((validator.count, validator.next_offset, 'unknown', [problem]))
+            validator.count += 1
+            validator.errors += 1
+            member_start = find_member_start(stream, validator.next_offset + 1, end) if gzipped else None
+    return validator.count, validator.failures
+
+
+def validate_warc_parallel(file_path, workers):
+    """Validate a per-record gzipped WARC by splitting it into byte ranges.
+
+    Each worker finds the first gzip member in its range and checks every
+    record starting before the end of the range. Errors are merged back in
+    file order and numbered as in the sequential report.
+    """
+    size = os.path.getsize(file_path)
+    n_ranges = max(1, min(workers * 4, size // MIN_RANGE_SIZE))
+    bounds = [size * i // n_ranges for i in range(n_ranges + 1)]
+    tasks = [(file_path, bounds[i], bounds[i + 1], False) for i in range(n_ranges)]
 
-def validate_warc(file_path):
-    print(f"--- Analyzing: {file_path} ---")
-    
     count = 0
     errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() yields results in range order, so record numbers stay ordered
+        for idx, (range_count, failures) in enumerate(executor.map(_validate_range, tasks), start=1):
+            for record_idx, _, rec_type, problems in failures:
+                for problem in problems:
+                    print(f"Error in record {count + record_idx} ({rec_type}): {problem}")
+            errors += len(failures)
+            count += range_count
+            print(f"Checked range {idx}/{n_ranges}, {count} records so far...")
+
+    return count, errors
+
+
+def validate_warc(file_path, workers=1, cache=None):
+    print(f"--- Analyzing: {file_path} ---")
     
     try:
-        with open(file_path, 'rb') as stream:
-            # ArchiveIterator handles both .warc and .warc.gz automatically
-            for record in ArchiveIterator(stream, check_digests=True):
-                try:
-                    # Accessing the content forces the library to check the digest
-                    record.content_stream().read()
-                    
-                    # Log basic info for every 100th record to show progress
-                    if count % 100 == 0:
-                        print(f"Processed {count} records...")
-                        
-                    count += 1
-                except Exception as e:
-                    print(f"Error in record {count} ({record.rec_type}): {e}")
-                    errors += 1
-                    count += 1
+        if cache is not None:
+            summary, identity = cache.lookup(file_path, 'validation')
+            # Files with errors are checked again, so the errors get listed
+            if summary is not None and summary['errors'] == 0:
+                print("--- Validation Complete (cached) ---")
+                print(f"Total records checked: {summary['records']}")
+                print("Integrity errors found: 0")
+                return True
+
+        if workers > 1 and file_path.lower().endswith('.gz'):
+            count, errors = validate_warc_parallel(file_path, workers)
+        else:
+            # Reading each record to its end forces the library to check the digest
+            count, failures = _validate_range((file_path, 0, os.path.getsize(file_path), True))
+            errors = len(failures)
+
+        if cache is not None:
+            cache.store(identity, 'validation', {'records': count, 'errors': errors})
 
         print("--- Validation Complete ---")
         print(f"Total records checked: {count}")
@@ -37,7 +98,14 @@ def validate_warc(file_path):
         print(f"Fatal error reading WARC: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python validate_warc.py <path_to_file.warc.gz>")
-    else:
-        validate_warc(sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Validate WARC record digests')
+    parser.add_argument('warc_file', help='Path to the input WARC or WARC.GZ file')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Validate gzip members of a .warc.gz in parallel with N processes (default: 1)')
+    parser.add_argument('--cache', help='SQLite summary cache; files that validated cleanly and are unchanged are not read again')
+    args = parser.parse_args()
+
+    cache = SummaryCache(args.cache) if args.cache else None
+    validate_warc(args.warc_file, workers=args.workers, cache=cache)
+    if cache is not None:
+        cache.close()
\ No newline at end of file
@@ -1,14 +1,9 @@
-import warcio
-from warcio.archiveiterator import ArchiveIterator
-from collections import Counter
+from warc_filter import add_filter_arguments, filter_from_args
+from warc_stats import collect_stats, expand_inputs, print_report
+from warc_summary_cache import SummaryCache
 import matplotlib.pyplot as plt
 import argparse
-
-parser = argparse.ArgumentParser(description='Plot MIME type distribution from a WARC file')
-parser.add_argument('warc_file', help='Path to the input WARC or WARC.GZ file')
-parser.add_argument('--output', '-o', help='Optional path to save the pie chart image (e.g., pie.png)')
-parser.add_argument('--min-percent', type=float, default=1.0, help='Minimum percent threshold; types below this are grouped into "Other" (default: 1.0)')
-args = parser.parse_args()
+import sys
 
 # Define colors here. Set PALETTE to either:
 # - a matplotlib colormap name (string) to sample colors from, e.g. 'tab20'
@@ -16,63 +11,83 @@ args = parser.parse_args()
 # - None to use matplotlib defaults
 PALETTE = 'Pastel2'
 
-warc_file_path = args.warc_file
 
-# Collect MIME types
-mime_types = []
+def main():
+    parser = argparse.ArgumentParser(description='Plot MIME type distribution from a WARC file or a collection of WARC files')
+    parser.add_argument('warc_files', nargs='+', metavar='warc_file',
+                        help='Path to the input WARC or WARC.GZ file; several files, directories or glob patterns for a whole collection')
+    parser.add_argument('--output', '-o', help='Optional path to save the pie chart image (e.g., pie.png)')
+    parser.add_argument('--min-percent', type=float, default=1.0, help='Minimum percent threshold; types below this are grouped into "Other" (default: 1.0)')
+    parser.add_argument('--by', choices=['count', 'bytes'], default='count', help='Size slices by record count or by payload bytes (default: count)')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Number of WARC files scanned in parallel (default: 1)')
+    parser.add_argument('--cache', help='SQLite summary cache; unchanged files are not scanned again')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
 
-with open(warc_file_path, 'rb') as stream:
-    for record in ArchiveIterator(stream):
-        if record.rec_type == 'response':
-            content_type = record.http_headers.get_header('Content-Type')
-            if content_type:
-                # Some Content-Types have parameters like charset, so split them
-                mime_type = content_type.split(';')[0].strip()
-                mime_types.append(mime_type)
+    warc_files = expand_inputs(args.warc_files)
+    if not warc_files:
+        parser.error('no WARC files found')
 
-# Count occurrences of each MIME type
-mime_counter = Counter(mime_types)
+    # Scan each file into a summary and merge them
+    cache = SummaryCache(args.cache) if args.cache else None
+    stats, failed = collect_stats(warc_files, args.workers, filter_from_args(args), use_index=not args.no_index,
+                                  cache=cache)
+    if cache is not None:
+        cache.close()
+    for file_path, error in failed:
+        print(f"Failed to read {file_path}: {error}", file=sys.stderr)
+    print_report(stats)
 
-# Prepare data for pie chart, grouping small categories into 'Other'
-total = sum(mime_counter.values())
-min_pct = max(0.0, args.min_percent) / 100.0
+    mime_counter = stats.counts['mime'] if args.by == 'count' else stats.sizes['mime']
 
-labels = []
-sizes = []
-other_count = 0
+    # Prepare data for pie chart, grouping small categories into 'Other'
+    total = sum(mime_counter.values())
+    min_pct = max(0.0, args.min_percent) / 100.0
 
-for mime, count in mime_counter.most_common():
-    pct = count / total if total > 0 else 0
-    if pct < min_pct:
-        other_count += count
-    else:
-        labels.append(mime)
-        sizes.append(count)
+    labels = []
+    sizes = []
+    other_count = 0
+
+    for mime, count in mime_counter.most_common():
+        pct = count / total if total > 0 else 0
+        if pct < min_pct:
+            other_count += count
+        else:
+            labels.append(mime)
+            sizes.append(count)
 
-if other_count > 0:
-    labels.append('Other')
-    sizes.append(other_count)
+    if other_count > 0:
+        labels.append('Other')
+        sizes.append(other_count)
+
+    # Create pie chart
+    plt.figure(figsize=(10, 8))
+    # Determine colors from PALETTE defined in the file
+    colors = None
+    if PALETTE:
+        if isinstance(PALETTE, (list, tuple)):
+            colors = list(PALETTE)
+        elif isinstance(PALETTE, str):
+            try:
+                cmap = plt.get_cmap(PALETTE)
+                colors = [cmap(i / max(1, len(sizes) - 1)) for i in range(len(sizes))]
+            except Exception:
+                # If colormap lookup fails, leave colors as None to use defaults
+                colors = None
+
+    plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, colors=colors)
+    title = 'MIME Type Distribution in WARC File' if len(warc_files) == 1 else f'MIME Type Distribution in {len(warc_files)} WARC Files'
+    if args.by == 'bytes':
+        title += ' (payload bytes)'
+    plt.title(title)
+    plt.axis('equal')  # Equal aspect ratio ensures the pie chart is circular
+    if args.output:
+        plt.savefig(args.output, bbox_inches='tight')
+        print(f"Saved pie chart to {args.output}")
+    else:
+        plt.show()
 
-# Create pie chart
-plt.figure(figsize=(10, 8))
-# Determine colors from PALETTE defined in the file
-colors = None
-if PALETTE:
-    if isinstance(PALETTE, (list, tuple)):
-        colors = list(PALETTE)
-    elif isinstance(PALETTE, str):
-        try:
-            cmap = plt.get_cmap(PALETTE)
-            colors = [cmap(i / max(1, len(sizes) - 1)) for i in range(len(sizes))]
-        except Exception:
-            # If colormap lookup fails, leave colors as None to use defaults
-            colors = None
 
-plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, colors=colors)
-plt.title('MIME Type Distribution in WARC File')
-plt.axis('equal')  # Equal aspect ratio ensures the pie chart is circular
-if args.output:
-    plt.savefig(args.output, bbox_inches='tight')
-    print(f"Saved pie chart to {args.output}")
-else:
-    plt.show()
+# Guarded so worker processes can import this file safely
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""warc_dedup.py
+
+Payload-digest deduplication helpers for the WARC writing scripts.
+
+`DigestIndex` is an on-disk SQLite table mapping a payload digest
+(`WARC-Payload-Digest`, e.g. `sha1:...`) to the target URI and `WARC-Date` of
+the first record seen with it. Lookups hit the SQLite B-tree on disk, so
+memory use is bounded by the page cache no matter how many records are
+indexed. The same index file can be reused across runs to deduplicate new
+harvests against everything merged before.
+
+`write_revisit()` writes a WARC `revisit` record (identical-payload-digest
+profile) pointing at the first capture.
+
+Usage:
+    python warc_dedup.py stats merged.warc.gz.dedup.sqlite
+"""
+
+from __future__ import annotations
+import argparse
+import sqlite3
+from typing import Optional, Tuple
+
+# Page cache size in KiB; bounds memory use of the index
+CACHE_SIZE_KB = 64 * 1024
+
+
+class DigestIndex:
+    """Persistent payload digest -> (first target URI, first WARC-Date) map."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            ' digest TEXT PRIMARY KEY,'
+            ' uri TEXT NOT NULL,'
+            ' date TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self.conn.commit()
+
+    def lookup(self, digest: str) -> Optional[Tuple[str, str]]:
+        return self.conn.execute('SELECT uri, date FROM digests WHERE digest = ?', (digest,)).fetchone()
+
+    def add(self, digest: str, uri: str, date: str) -> None:
+        self.conn.execute('INSERT OR IGNORE INTO digests (digest, uri, date) VALUES (?, ?, ?)', (digest, uri, date))
+
+    def lookup_or_add(self, digest: str, uri: str, date: str) -> Optional[Tuple[str, str]]:
+        """Return the first `(uri, date)` seen for `digest`, or record this one and return None."""
+        original = self.lookup(digest)
+        if original is None:
+            self.add(digest, uri, date)
+        return original
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def rollback(self) -> None:
+        """Forget digests added since the last commit (e.g. when an input is re-read)."""
+        self.conn.rollback()
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self) -> 'DigestIndex':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_revisit(writer, uri: str, date: str, digest: str, original: Tuple[str, str], http_headers=None) -> None:
+    """Write a revisit record for a duplicate of `original` (`(uri, date)`)."""
+    refers_to_uri, refers_to_date = original
+    record = writer.create_revisit_record(uri, digest, refers_to_uri, refers_to_date,
+                                          http_headers=http_headers,
+                                          warc_headers_dict={'WARC-Date': date})
+    writer.write_record(record)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect a payload digest index')
+    parser.add_argument('command', choices=['stats'])
+    parser.add_argument('index', help='Path to the SQLite digest index')
+    args = parser.parse_args()
+
+    with DigestIndex(args.index) as index:
+        print(f"Digests indexed: {len(index)}")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""warc_filter.py
+
+Select WARC records by URL, date, MIME type and HTTP status.
+
+A `RecordFilter` is checked against the WARC and HTTP headers of a record,
+before its payload is read or decompressed (see `scan_warc(record_filter=)`).
+When a CDXJ sidecar (`<file>.cdxj`, see cdxj_index.py) is present and not
+older than the WARC, `scan_filtered()` matches the filter against the index
+instead and only reads the matching records, seeking over everything else.
+With `--surt-prefix` only the matching slice of the sorted index is read.
+
+Filters (all given filters must match):
+    --url-glob 'https://example.com/news/*'   shell-style pattern on the URL
+    --url-regex 'example\\.com/.*\\.s?html$'   regular expression searched in the URL
+    --surt-prefix 'com,example)/news'         prefix of the SURT key (see cdxj_index.surt_key)
+    --from 2003 --to 2003-06                  WARC-Date range, partial dates are
+                                              expanded (`--to` is inclusive)
+    --mime text/html --mime 'image/*'         MIME type patterns (any may match)
+    --status 200 --status '3*'                HTTP status patterns (any may match)
+
+Usage:
+    python warc_filter.py archive.warc.gz --surt-prefix 'com,example)/' --from 2003 --to 2003
+"""
+
+from __future__ import annotations
+import argparse
+import fnmatch
+import os
+import re
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cdxj_index import INDEXED_TYPES, REVISIT_MIME, UNKNOWN_MIME, bisect_index, parse_line, read_index, sidecar_path, surt_key, warc_date_to_timestamp
+from warc_scan import WarcConsumer, ScannedRecord, get_mime_type, scan_warc
+
+
+class RecordFilter:
+    """Header-level record filter; an empty filter accepts every record."""
+
+    def __init__(self, url_glob: Optional[str] = None, url_regex: Optional[str] = None,
+                 surt_prefix: Optional[str] = None, date_from: Optional[str] = None,
+                 date_to: Optional[str] = None, mime: Optional[List[str]] = None,
+                 status: Optional[List[str]] = None) -> None:
+        self.url_glob = url_glob
+        self.url_regex = re.compile(url_regex) if url_regex else None
+        self.surt_prefix = surt_prefix
+        self.date_from = warc_date_to_timestamp(date_from) if date_from else None
+        self.date_to = warc_date_to_timestamp(date_to) if date_to else None
+        self.mime = [m.lower() for m in mime or []]
+        self.status = list(status or [])
+
+    @property
+    def empty(self) -> bool:
+        return not (self.url_glob or self.url_regex or self.surt_prefix or self.date_from
+                    or self.date_to or self.mime or self.status)
+
+    def matches(self, url: str, timestamp: str, mime: Optional[str], status: Optional[str],
+                key: Optional[str] = None) -> bool:
+        """Check the extracted fields of one record; `key` is its SURT key if known."""
+        if self.url_glob and not fnmatch.fnmatchcase(url, self.url_glob):
+            return False
+        if self.url_regex and not self.url_regex.search(url):
+            return False
+        if self.surt_prefix and not (key if key is not None else surt_key(url)).startswith(self.surt_prefix):
+            return False
+        if self.date_from and timestamp < self.date_from:
+            return False
+        # Compare at the precision given, so `--to 2003` includes all of 2003
+        if self.date_to and timestamp[:len(self.date_to)] > self.date_to:
+            return False
+        if self.mime and not any(fnmatch.fnmatchcase((mime or '').lower(), m) for m in self.mime):
+            return False
+        if self.status and not any(fnmatch.fnmatchcase(status or '', s) for s in self.status):
+            return False
+        return True
+
+    def accepts(self, record) -> bool:
+        """Check a warcio record on its headers only."""
+        if self.empty:
+            return True
+        url = record.rec_headers.get_header('WARC-Target-URI') or ''
+        timestamp = warc_date_to_timestamp(record.rec_headers.get_header('WARC-Date'))
+        if record.rec_type == 'revisit':
+            mime = REVISIT_MIME
+        else:
+            mime = get_mime_type(record)
+        status = record.http_headers.get_statuscode() if record.http_headers else None
+        return self.matches(url, timestamp, mime, status)
+
+    def accepts_entry(self, key: str, timestamp: str, fields: Dict[str, str]) -> bool:
+        """Check a parsed CDXJ index line."""
+        # The index marks a missing Content-Type as `unk`, a record has none
+        mime = fields.get('mime')
+        mime = None if mime == UNKNOWN_MIME else mime
+        return self.matches(fields.get('url', ''), timestamp, mime, fields.get('status'), key=key)
+
+
+def add_filter_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group('record filters', 'Only process records matching all given filters')
+    group.add_argument('--url-glob', help="Shell-style pattern the URL must match, e.g. 'https://example.com/news/*'")
+    group.add_argument('--url-regex', help='Regular expression searched in the URL')
+    group.add_argument('--surt-prefix', help="SURT key prefix, e.g. 'com,example)/news'")
+    group.add_argument('--from', dest='date_from', help='Earliest WARC-Date, e.g. 2003 or 2003-05-01')
+    group.add_argument('--to', dest='date_to', help='Latest WARC-Date (inclusive at the given precision)')
+    group.add_argument('--mime', dest='mime_types', action='append', help="MIME type pattern, e.g. 'text/*' (repeatable)")
+    group.add_argument('--status', action='append', help="HTTP status pattern, e.g. 200 or '3*' (repeatable)")
+    group.add_argument('--no-index', action='store_true', help='Scan the WARC even if a CDXJ sidecar exists')
+
+
+def filter_from_args(args: argparse.Namespace) -> RecordFilter:
+    return RecordFilter(url_glob=args.url_glob, url_regex=args.url_regex, surt_prefix=args.surt_prefix,
+                        date_from=args.date_from, date_to=args.date_to, mime=args.mime_types,
+                        status=args.status)
+
+
+def usable_index(warc_path: str) -> Optional[str]:
+    """Return the CDXJ sidecar of `warc_path` if it exists and is up to date."""
+    cdxj_path = sidecar_path(warc_path)
+    if os.path.exists(cdxj_path) and os.path.getmtime(cdxj_path) >= os.path.getmtime(warc_path):
+        return cdxj_path
+    return None
+
+
+def _index_entries(cdxj_path: str, surt_prefix: Optional[str]) -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    if not surt_prefix:
+        yield from read_index(cdxj_path)
+        return
+    # The index is sorted by SURT key: read only the lines sharing the prefix
+    with open(cdxj_path, 'rb') as f:
+        f.seek(bisect_index(f, surt_prefix))
+        for raw in f:
+            entry = parse_line(raw.decode('utf-8'))
+            if not entry[0].startswith(surt_prefix):
+                break
+            yield entry
+
+
+def index_spans(cdxj_path: str, record_filter: RecordFilter) -> List[Tuple[int, int]]:
+    """Return `(offset, length)` of every indexed record matching the filter, in file order."""
+    spans = [(int(fields['offset']), int(fields['length']))
+             for key, timestamp, fields in _index_entries(cdxj_path, record_filter.surt_prefix)
+             if record_filter.accepts_entry(key, timestamp, fields)]
+    spans.sort()
+    return spans
+
+
+def scan_filtered(file_path: str, consumers: Iterable[WarcConsumer], record_filter: RecordFilter,
+                  use_index: bool = True, start: int = 0) -> list:
+    """`scan_warc()` restricted to records matching `record_filter`.
+
+    Uses the CDXJ sidecar to seek straight to the matching records when one
+    is available. The index only covers `response` and `revisit` records.
+    """
+    cdxj_path = usable_index(file_path) if use_index and not record_filter.empty else None
+    if cdxj_path is None:
+        return scan_warc(file_path, consumers, start=start, record_filter=record_filter)
+    spans = index_spans(cdxj_path, record_filter)
+    print(f"Using index {cdxj_path}: {len(spans)} matching records", file=sys.stderr)
+    return scan_warc(file_path, consumers, start=start, record_filter=record_filter, spans=spans)
+
+
+class RecordLister(WarcConsumer):
+    """Collect timestamp, status, MIME type and URL of every response/revisit record."""
+
+    def __init__(self) -> None:
+        self.rows: List[Tuple[str, str, str, str]] = []
+
+    def accepts(self, record) -> bool:
+        # Same records as in a CDXJ index, with or without one
+        return record.rec_type in INDEXED_TYPES
+
+    def consume(self, item: ScannedRecord) -> None:
+        record = item.record
+        self.rows.append((
+            warc_date_to_timestamp(record.rec_headers.get_header('WARC-Date')),
+            (record.http_headers.get_statuscode() if record.http_headers else None) or '-',
+            get_mime_type(record) or '-',
+            record.rec_headers.get_header('WARC-Target-URI') or '',
+        ))
+
+    def finish(self) -> List[Tuple[str, str, str, str]]:
+        return self.rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='List WARC records matching URL, date, MIME and status filters')
+    parser.add_argument('warc_file', help='Path to the input WARC or WARC.GZ file')
+    add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+
+    rows, = scan_filtered(args.warc_file, [RecordLister()], filter_from_args(args), use_index=not args.no_index)
+    for row in rows:
+        print(' '.join(row))
+    print(f"Matching records: {len(rows)}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
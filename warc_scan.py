@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""warc_scan.py
+
+Single-pass WARC scanning engine shared by the WARC scripts.
+
+Each record of a WARC/WARC.GZ file is read and decompressed exactly once and
+handed to any number of consumers. A consumer decides per record whether it
+is interested (`accepts`) and whether it needs the decoded payload bytes
+(`needs_payload`); the payload is read at most once per record and shared
+between all consumers that asked for it.
+
+The scripts `count_warc.py`, `warc_content_pie.py`, `validate_warc.py` and
+`markdown_render_html_from_warc.py` are thin wrappers around the consumers
+defined here. Running this module directly combines them so a full QA pass
+only reads each archive once.
+
+Usage:
+    python warc_scan.py archive.warc.gz --count --mime --validate \
+        --markdown-dir markdown_pages
+
+Notes:
+- Digest problems are reported for records that carry `WARC-Block-Digest`
+  and/or `WARC-Payload-Digest` headers.
+- Consumers receive a `ScannedRecord` holding the warcio record, the payload
+  (or None), the record offset/length in the file, the offset where the next
+  record starts (a valid `start` for resuming a scan), any read error and
+  the stored payload size (record block minus HTTP headers).
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    from warcio.archiveiterator import ArchiveIterator
+except Exception as e:
+    print("Required package 'warcio' is not installed. Install with: pip install warcio", file=sys.stderr)
+    raise
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+WARC_MAGIC = b'WARC/'
+BLOCK_SIZE = 1024 * 1024
+PROBE_SIZE = 4096
+GZIP_FEED_SIZE = 16 * 1024
+
+
+class ScannedRecord(NamedTuple):
+    record: object
+    payload: Optional[bytes]
+    offset: int
+    length: int
+    error: Optional[Exception]
+    next_offset: int = -1
+    payload_length: int = -1
+
+
+class WarcConsumer:
+    """Base class for consumers fed by `scan_warc()`.
+
+    Subclasses override `accepts()` to pick records by their headers,
+    `consume()` to handle each accepted record and `finish()` to produce a
+    result once the whole file has been read.
+    """
+
+    needs_payload = False
+    check_digests = False
+
+    def accepts(self, record) -> bool:
+        return True
+
+    def consume(self, item: ScannedRecord) -> None:
+        pass
+
+    def finish(self):
+        return None
+
+
+def find_warc_files(input_dir: str) -> List[str]:
+    """Recursively find files that look like WARC files in input_dir.
+
+    Matches case-insensitively on .warc and .warc.gz.
+    """
+    matches: List[str] = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            lname = name.lower()
+            if lname.endswith('.warc') or lname.endswith('.warc.gz'):
+                matches.append(os.path.join(root, name))
+    matches.sort()
+    return matches
+
+
+def get_mime_type(record) -> Optional[str]:
+    """Return the HTTP Content-Type of a record without parameters."""
+    if not record.http_headers:
+        return None
+    content_type = record.http_headers.get_header('Content-Type')
+    if not content_type:
+        return None
+    # Some Content-Types have parameters like charset, so split them
+    return content_type.split(';')[0].strip()
+
+
+class ResponseCounter(WarcConsumer):
+    """Count WARC `response` records."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def accepts(self, record) -> bool:
+        return record.rec_type == 'response'
+
+    def consume(self, item: ScannedRecord) -> None:
+        self.count += 1
+
+    def finish(self) -> int:
+        return self.count
+
+
+class MimeCounter(WarcConsumer):
+    """Count MIME types of `response` records."""
+
+    def __init__(self) -> None:
+        self.counter: Counter = Counter()
+
+    def accepts(self, record) -> bool:
+        return record.rec_type == 'response'
+
+    def consume(self, item: ScannedRecord) -> None:
+        mime_type = get_mime_type(item.record)
+        if mime_type:
+            self.counter[mime_type] += 1
+
+    def finish(self) -> Counter:
+        return self.counter
+
+
+def record_problems(item: ScannedRecord) -> List[str]:
+    """Return read errors and digest failures found for a scanned record."""
+    problems = []
+    if item.error is not None:
+        problems.append(str(item.error))
+    if item.record.digest_checker is not None:
+        problems.extend(item.record.digest_checker.problems)
+    return problems
+
+
+class DigestValidator(WarcConsumer):
+    """Check block/payload digests and report unreadable records.
+
+    Failing records are collected in `failures` as
+    `(record_index, offset, rec_type, problems)`. With `report=True` progress
+    is printed every `progress_every` records along with one line per problem.
+    `next_offset` is the start of the record after the last one read to its
+    end. `finish()` returns the number of errors found.
+    """
+
+    check_digests = True
+
+    def __init__(self, progress_every: int = 100, report: bool = True) -> None:
+        self.progress_every = progress_every
+        self.report = report
+        self.count = 0
+        self.errors = 0
+        self.failures: List[Tuple[int, int, str, List[str]]] = []
+        self.next_offset = 0
+
+    def consume(self, item: ScannedRecord) -> None:
+        record = item.record
+        problems = record_problems(item)
+        if problems:
+            self.errors += 1
+            self.failures.append((self.count, item.offset, record.rec_type, problems))
+
+        if self.report:
+            for problem in problems:
+                print(f"Error in record {self.count} ({record.rec_type}): {problem}")
+            # Log basic info for every 100th record to show progress
+            if self.progress_every and self.count % self.progress_every == 0:
+                print(f"Processed {self.count} records...")
+        self.count += 1
+        if item.next_offset >= 0:
+            self.next_offset = item.next_offset
+
+    def finish(self) -> int:
+        return self.errors
+
+
+def find_member_start(stream, start: int, end: int) -> Optional[int]:
+    """Return the offset of the first gzip member in `[start, end)` holding a WARC record.
+
+    Candidates are found by the gzip magic bytes and confirmed by inflating
+    the first bytes of the member, which must begin with `WARC/`.
+    """
+    pos = start
+    while pos < end:
+        stream.seek(pos)
+        block = stream.read(min(BLOCK_SIZE, end - pos) + len(GZIP_MAGIC) - 1)
+        idx = block.find(GZIP_MAGIC)
+        while idx != -1 and pos + idx < end:
+            stream.seek(pos + idx)
+            try:
+                head = zlib.decompressobj(31).decompress(stream.read(PROBE_SIZE), len(WARC_MAGIC))
+            except zlib.error:
+                head = b''
+            if head == WARC_MAGIC:
+                return pos + idx
+            idx = block.find(GZIP_MAGIC, idx + 1)
+        pos += BLOCK_SIZE
+    return None
+
+
+def is_gzip_file(file_path: str) -> bool:
+    with open(file_path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC[:2]
+
+
+def parse_warc_header_block(block: bytes) -> Dict[str, str]:
+    """Parse a WARC header block (without the version line) into a dict.
+
+    Header names are lower-cased.
+    """
+    headers: Dict[str, str] = {}
+    for line in block.decode('utf-8', 'replace').splitlines():
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _gunzip_chunks(stream) -> Iterator[bytes]:
+    """Decompress a multi-member gzip stream chunk by chunk.
+
+    Input is fed in small pieces so the unused tail copied at the end of
+    every member stays small for per-record gzipped WARCs. Zero bytes
+    between or after members (padding some writers add) are skipped.
+    """
+    decompressor = zlib.decompressobj(31)
+    at_member_start = True
+    while True:
+        data = stream.read(GZIP_FEED_SIZE)
+        if not data:
+            return
+        while data:
+            if at_member_start:
+                data = data.lstrip(b'\0')
+                if not data:
+                    break
+                at_member_start = False
+            out = decompressor.decompress(data)
+            if out:
+                yield out
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+                at_member_start = True
+            else:
+                data = b''
+
+
+def _iter_gzip_headers(stream) -> Iterator[Tuple[Dict[str, str], int]]:
+    buf = bytearray()
+    skip = 0
+    for chunk in _gunzip_chunks(stream):
+        if skip:
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:]
+            skip = 0
+        buf += chunk
+        pos = 0
+        while True:
+            # Blank lines that terminate the previous record
+            while buf[pos:pos + 1] in (b'\r', b'\n'):
+                pos += 1
+            end = buf.find(b'\r\n\r\n', pos)
+            if end == -1:
+                break
+            if not buf.startswith(WARC_MAGIC, pos):
+                raise ValueError(f"Expected a WARC record header, got {bytes(buf[pos:pos + 40])!r}")
+            version_end = buf.find(b'\r\n', pos)
+            headers = parse_warc_header_block(bytes(buf[version_end + 2:end]))
+            length = int(headers.get('content-length') or 0)
+            yield headers, length
+
+            rest = len(buf) - end - 4
+            if length >= rest:
+                skip = length - rest
+                pos = len(buf)
+                break
+            pos = end + 4 + length
+        # Drop what was parsed or skipped; only an incomplete header is kept
+        del buf[:pos]
+
+
+def _iter_plain_headers(stream) -> Iterator[Tuple[Dict[str, str], int]]:
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.strip():
+            # Blank lines that terminate the previous record
+            continue
+        if not line.startswith(WARC_MAGIC):
+            raise ValueError(f"Expected a WARC record header, got {line[:40]!r}")
+
+        lines = []
+        while True:
+            line = stream.readline()
+            if not line.strip():
+                break
+            lines.append(line)
+        headers = parse_warc_header_block(b''.join(lines))
+        length = int(headers.get('content-length') or 0)
+        yield headers, length
+        stream.seek(length, 1)
+
+
+def iter_warc_headers(file_path: str) -> Iterator[Tuple[Dict[str, str], int]]:
+    """Yield `(warc_headers, content_length)` for every record of a WARC.
+
+    Only the WARC header block is parsed; record blocks are skipped using
+    `Content-Length` without building record objects or parsing HTTP
+    headers. Uncompressed files are skipped with real seeks, gzipped files
+    are decompressed and discarded. Header names are lower-cased.
+    """
+    with open(file_path, 'rb') as stream:
+        if is_gzip_file(file_path):
+            yield from _iter_gzip_headers(stream)
+        else:
+            yield from _iter_plain_headers(stream)
+
+
+def _feed_record(iterator, record, consumers: List[WarcConsumer], record_filter=None) -> None:
+    """Hand one record of `iterator` to the consumers that accept it."""
+    if record_filter is not None and not record_filter.accepts(record):
+        return
+    active = [c for c in consumers if c.accepts(record)]
+    if not active:
+        return
+
+    # Bytes left after the HTTP headers, known before anything is read
+    payload_length = getattr(record.raw_stream, 'limit', -1)
+    payload = None
+    error = None
+    try:
+        if any(c.needs_payload for c in active):
+            payload = record.content_stream().read()
+        # Drain the rest of the record; this finalizes digest checks
+        # and makes the record offset and length available.
+        iterator.read_to_end(record)
+        offset = iterator.get_record_offset()
+        length = iterator.get_record_length()
+        next_offset = iterator.offset
+    except Exception as exc:
+        error = exc
+        offset, length, next_offset = -1, -1, -1
+
+    item = ScannedRecord(record, payload, offset, length, error, next_offset, payload_length)
+    for consumer in active:
+        consumer.consume(item)
+
+
+def scan_warc(file_path: str, consumers: Iterable[WarcConsumer],
+              start: int = 0, end: Optional[int] = None,
+              record_filter=None, spans: Optional[Iterable[Tuple[int, int]]] = None) -> list:
+    """Read `file_path` once and feed every record to `consumers`.
+
+    `start` must be the offset of a record (a gzip member for `.warc.gz`);
+    with `end` set, only records starting before `end` are scanned.
+    `record_filter` (any object with an `accepts(record)` method, see
+    warc_filter.py) drops records on their headers before any consumer or
+    payload read. With `spans`, an iterable of `(offset, length)` sorted by
+    offset (e.g. from a CDXJ index), only the records at those offsets are
+    read, seeking over everything in between.
+    Returns the list of `consumer.finish()` results, in consumer order.
+    """
+    consumers = list(consumers)
+    check_digests = any(c.check_digests for c in consumers)
+
+    with open(file_path, 'rb') as stream:
+        if spans is not None:
+            for offset, _ in spans:
+                if offset < start:
+                    continue
+                if end is not None and offset >= end:
+                    break
+                stream.seek(offset)
+                iterator = ArchiveIterator(stream, check_digests=check_digests)
+                record = next(iterator, None)
+                if record is not None:
+                    _feed_record(iterator, record, consumers, record_filter)
+            return [c.finish() for c in consumers]
+
+        stream.seek(start)
+        # ArchiveIterator handles both .warc and .warc.gz automatically
+        iterator = ArchiveIterator(stream, check_digests=check_digests)
+        for record in iterator:
+            # Until the record is read, the iterator offset is its start
+            if end is not None and iterator.offset >= end:
+                break
+            _feed_record(iterator, record, consumers, record_filter)
+
+    return [c.finish() for c in consumers]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run several WARC checks in a single pass over each file')
+    parser.add_argument('warc_files', nargs='+', help='Input WARC or WARC.GZ files')
+    parser.add_argument('--count', action='store_true', help='Count response records')
+    parser.add_argument('--mime', action='store_true', help='Count MIME types of response records')
+    parser.add_argument('--validate', action='store_true', help='Check record digests')
+    parser.add_argument('--markdown-dir', help='Also convert HTML pages to Markdown files in this directory '
+                                               '(or file, with --markdown-format)')
+    parser.add_argument('--markdown-format', default='files', choices=['files', 'jsonl.zst', 'zip', 'parquet'],
+                        help='Output format for --markdown-dir (default: files)')
+    parser.add_argument('--markdown-workers', type=int, default=1,
+                        help='Number of processes converting pages for --markdown-dir (default: 1)')
+    args = parser.parse_args(argv)
+
+    if not (args.count or args.mime or args.validate or args.markdown_dir):
+        parser.error('choose at least one of --count, --mime, --validate or --markdown-dir')
+
+    sink = None
+    if args.markdown_dir:
+        from markdown_render_html_from_warc import OUTPUT_FORMATS, MarkdownExporter
+        # One sink for all inputs: single-file formats cannot be reopened per WARC
+        writer_class, _ = OUTPUT_FORMATS[args.markdown_format]
+        sink = writer_class(args.markdown_dir)
+
+    all_valid = True
+    for warc_file in args.warc_files:
+        print(f"--- Scanning: {warc_file} ---")
+        consumers: List[WarcConsumer] = []
+        if args.count:
+            consumers.append(ResponseCounter())
+        if args.mime:
+            consumers.append(MimeCounter())
+        if args.validate:
+            consumers.append(DigestValidator())
+        if sink is not None:
+            consumers.append(MarkdownExporter(args.markdown_dir, workers=args.markdown_workers, sink=sink))
+
+        scan_warc(warc_file, consumers)
+
+        for consumer in consumers:
+            if isinstance(consumer, ResponseCounter):
+                print(f"Response records: {consumer.count}")
+            elif isinstance(consumer, MimeCounter):
+                for mime, count in consumer.counter.most_common():
+                    print(f"{count:>10}  {mime}")
+            elif isinstance(consumer, DigestValidator):
+                print(f"Total records checked: {consumer.count}")
+                print(f"Integrity errors found: {consumer.errors}")
+                all_valid = all_valid and consumer.errors == 0
+            else:
+                print(f"Extracted and converted {consumer.count} HTML pages to Markdown in '{consumer.output}'")
+
+    if sink is not None:
+        sink.close()
+    return 0 if all_valid else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
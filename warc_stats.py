@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""warc_stats.py
+
+Map-reduce MIME type, HTTP status and per-year statistics over a collection
+of WARC files.
+
+Each file is scanned by one worker process into a `WarcStats` summary
+(record count and stored payload bytes per MIME type, per status and per
+capture year). Summaries are merged as workers finish, so memory depends on
+the number of distinct keys, never on the number of records. Payload sizes
+are taken from the record headers, so payloads are never held in memory,
+but records are still read through (and decompressed for `.warc.gz`) on the
+way to the next one. Responses without an HTTP Content-Type count towards
+the totals, statuses and years but not the MIME types, as in the content
+pie.
+
+Inputs may be WARC files, directories (searched recursively for `.warc` and
+`.warc.gz`) or glob patterns. The record filters of warc_filter.py apply to
+every file.
+
+With `--cache FILE` the summary of every file is kept in a SQLite summary
+cache (see warc_summary_cache.py); unchanged files are then answered from
+the cache and only new or changed files are scanned. Filtered runs bypass
+the cache.
+
+Usage:
+    python warc_stats.py harvest/ --workers 8
+    python warc_stats.py 'crawls/*/*.warc.gz' --from 2003 --to 2005 --workers 8
+    python warc_stats.py harvest/ --workers 8 --cache warc_summaries.sqlite
+"""
+
+from __future__ import annotations
+import argparse
+import glob
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from warc_filter import RecordFilter, add_filter_arguments, filter_from_args, scan_filtered
+from warc_scan import ScannedRecord, WarcConsumer, find_warc_files, get_mime_type
+from warc_summary_cache import SummaryCache
+
+DIMENSIONS = ('mime', 'status', 'year')
+# Summary kind in the summary cache; bumped when what a summary counts changes
+CACHE_KIND = 'stats-v3'
+
+
+class WarcStats:
+    """Mergeable record counts and payload bytes per MIME type, status and year."""
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.records = 0
+        self.bytes = 0
+        self.counts: Dict[str, Counter] = {dim: Counter() for dim in DIMENSIONS}
+        self.sizes: Dict[str, Counter] = {dim: Counter() for dim in DIMENSIONS}
+
+    def add(self, mime: Optional[str], status: str, year: str, size: int) -> None:
+        self.records += 1
+        self.bytes += size
+        for dim, key in zip(DIMENSIONS, (mime, status, year)):
+            if key is None:
+                continue
+            self.counts[dim][key] += 1
+            self.sizes[dim][key] += size
+
+    def merge(self, other: 'WarcStats') -> 'WarcStats':
+        self.files += other.files
+        self.records += other.records
+        self.bytes += other.bytes
+        for dim in DIMENSIONS:
+            self.counts[dim].update(other.counts[dim])
+            self.sizes[dim].update(other.sizes[dim])
+        return self
+
+    def to_dict(self) -> dict:
+        return {'files': self.files, 'records': self.records, 'bytes': self.bytes,
+                'counts': self.counts, 'sizes': self.sizes}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'WarcStats':
+        stats = cls()
+        stats.files, stats.records, stats.bytes = data['files'], data['records'], data['bytes']
+        for dim in DIMENSIONS:
+            stats.counts[dim].update(data['counts'][dim])
+            stats.sizes[dim].update(data['sizes'][dim])
+        return stats
+
+
+class StatsCollector(WarcConsumer):
+    """Summarize the `response` records of one WARC into a `WarcStats`."""
+
+    def __init__(self) -> None:
+        self.stats = WarcStats()
+        self.stats.files = 1
+
+    def accepts(self, record) -> bool:
+        return record.rec_type == 'response'
+
+    def consume(self, item: ScannedRecord) -> None:
+        record = item.record
+        # Like the content pie, responses without a Content-Type get no MIME type
+        mime = get_mime_type(record) or None
+        status = (record.http_headers.get_statuscode() if record.http_headers else None) or '-'
+        year = (record.rec_headers.get_header('WARC-Date') or '')[:4] or '-'
+        self.stats.add(mime, status, year, max(item.payload_length, 0))
+
+    def finish(self) -> WarcStats:
+        return self.stats
+
+
+def expand_inputs(inputs: Iterable[str]) -> List[str]:
+    """Resolve files, directories and glob patterns to a sorted list of WARC files."""
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            files.update(find_warc_files(item))
+        elif os.path.exists(item):
+            files.add(item)
+        else:
+            for match in glob.glob(item, recursive=True):
+                if os.path.isdir(match):
+                    files.update(find_warc_files(match))
+                else:
+                    files.add(match)
+    return sorted(files)
+
+
+def summarize_file(task: Tuple[str, Optional[RecordFilter], bool]) -> WarcStats:
+    file_path, record_filter, use_index = task
+    stats, = scan_filtered(file_path, [StatsCollector()], record_filter or RecordFilter(), use_index=use_index)
+    return stats
+
+
+def collect_stats(files: List[str], workers: int = 1, record_filter: Optional[RecordFilter] = None,
+                  use_index: bool = True, cache: Optional[SummaryCache] = None
+                  ) -> Tuple[WarcStats, List[Tuple[str, Exception]]]:
+    """Scan `files` in `workers` processes and merge their summaries.
+
+    With a `SummaryCache` (ignored for filtered runs), files whose cached
+    summary is still valid are not scanned and new summaries are stored.
+    Returns the merged summary and a list of `(file, error)` for files that
+    could not be read.
+    """
+    total = WarcStats()
+    failed: List[Tuple[str, Exception]] = []
+    if record_filter is not None and not record_filter.empty:
+        cache = None
+
+    identities = {}
+    tasks = []
+    for f in files:
+        if cache is not None:
+            summary, identities[f] = cache.lookup(f, CACHE_KIND)
+            if summary is not None:
+                total.merge(WarcStats.from_dict(summary))
+                continue
+        tasks.append((f, record_filter, use_index))
+    if cache is not None:
+        print(f"Summaries from cache: {len(files) - len(tasks)}/{len(files)} files", file=sys.stderr)
+
+    def add(file_path: str, stats: WarcStats) -> None:
+        total.merge(stats)
+        if cache is not None:
+            cache.store(identities[file_path], CACHE_KIND, stats.to_dict())
+
+    if workers <= 1:
+        for task in tasks:
+            try:
+                add(task[0], summarize_file(task))
+            except Exception as e:
+                failed.append((task[0], e))
+        return total, failed
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(summarize_file, task): task[0] for task in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                add(futures[future], future.result())
+            except Exception as e:
+                failed.append((futures[future], e))
+            print(f"[{done}/{len(tasks)}] {futures[future]}", file=sys.stderr, flush=True)
+    return total, failed
+
+
+def format_size(num_bytes: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if num_bytes < 1024 or unit == 'TB':
+            return f"{num_bytes:.0f} {unit}" if unit == 'B' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def print_report(stats: WarcStats, top: Optional[int] = None) -> None:
+    print(f"Files: {stats.files}  Response records: {stats.records}  Payload bytes: {stats.bytes} ({format_size(stats.bytes)})")
+    titles = {'mime': 'MIME type', 'status': 'HTTP status', 'year': 'Year'}
+    for dim in DIMENSIONS:
+        print(f"\n{titles[dim]}:")
+        if dim == 'year':
+            rows = sorted(stats.counts[dim].items())
+        else:
+            rows = stats.counts[dim].most_common(top)
+        for key, count in rows:
+            print(f"{count:>12}  {stats.sizes[dim][key]:>16}  {key}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='MIME, status and per-year statistics over a WARC collection')
+    parser.add_argument('inputs', nargs='+', help='WARC files, directories or glob patterns')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Number of files scanned in parallel (default: number of CPUs)')
+    parser.add_argument('--top', type=int, help='Only list the N most common MIME types and statuses')
+    parser.add_argument('--cache', help='SQLite summary cache; unchanged files are not scanned again')
+    add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No WARC files found", file=sys.stderr)
+        return 1
+
+    cache = SummaryCache(args.cache) if args.cache else None
+    stats, failed = collect_stats(files, args.workers, filter_from_args(args), use_index=not args.no_index,
+                                  cache=cache)
+    if cache is not None:
+        cache.close()
+    print_report(stats, args.top)
+    for file_path, error in failed:
+        print(f"Failed to read {file_path}: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
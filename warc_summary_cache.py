@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""warc_summary_cache.py
+
+Persistent cache of per-WARC summaries for the reporting scripts.
+
+Summaries (response counts, WARC-Type histograms, MIME/status/year
+statistics, validation results) are stored as JSON in one SQLite file,
+keyed on the absolute path of the WARC and the kind of summary. Each entry
+remembers the identity of the file it was computed from: size, mtime and a
+SHA-1 of its first 64 KiB (the warcinfo and first records). A cached summary
+is only served while all three still match, so new or changed files are
+scanned again and everything else is answered without decompressing
+anything.
+
+Used by `count_warc.py`, `warc_content_pie.py`, `warc_stats.py` and
+`validate_warc.py` through their `--cache FILE` option.
+
+Usage:
+    python warc_summary_cache.py stats warc_summaries.sqlite
+    python warc_summary_cache.py prune warc_summaries.sqlite
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Any, Optional, Tuple
+
+HEAD_HASH_BYTES = 64 * 1024
+
+# (absolute path, size, mtime_ns, head hash)
+FileIdentity = Tuple[str, int, int, str]
+
+
+def file_identity(file_path: str) -> FileIdentity:
+    path = os.path.abspath(file_path)
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        head_hash = hashlib.sha1(f.read(HEAD_HASH_BYTES)).hexdigest()
+    return path, st.st_size, st.st_mtime_ns, head_hash
+
+
+class SummaryCache:
+    """SQLite store of JSON summaries keyed on WARC path and summary kind."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS summaries ('
+            ' path TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' head_hash TEXT NOT NULL,'
+            ' summary TEXT NOT NULL,'
+            ' PRIMARY KEY (path, kind)'
+            ') WITHOUT ROWID'
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, file_path: str, kind: str) -> Tuple[Optional[Any], FileIdentity]:
+        """Return `(summary, identity)`; summary is None unless the cached entry is still valid.
+
+        Pass `identity` to `store()` once the summary has been computed, so the
+        entry describes the file as it was before the scan.
+        """
+        identity = file_identity(file_path)
+        row = self.conn.execute('SELECT size, mtime_ns, head_hash, summary FROM summaries WHERE path = ? AND kind = ?',
+                                (identity[0], kind)).fetchone()
+        if row is not None and tuple(row[:3]) == identity[1:]:
+            self.hits += 1
+            return json.loads(row[3]), identity
+        self.misses += 1
+        return None, identity
+
+    def store(self, identity: FileIdentity, kind: str, summary: Any) -> None:
+        path, size, mtime_ns, head_hash = identity
+        self.conn.execute('INSERT OR REPLACE INTO summaries (path, kind, size, mtime_ns, head_hash, summary) '
+                          'VALUES (?, ?, ?, ?, ?, ?)', (path, kind, size, mtime_ns, head_hash, json.dumps(summary)))
+        # Commit per file, so an interrupted report keeps what it computed
+        self.conn.commit()
+
+    def prune(self) -> int:
+        """Drop entries of files that no longer exist; returns the number removed."""
+        paths = [row[0] for row in self.conn.execute('SELECT DISTINCT path FROM summaries')]
+        gone = [(p,) for p in paths if not os.path.exists(p)]
+        self.conn.executemany('DELETE FROM summaries WHERE path = ?', gone)
+        self.conn.commit()
+        return len(gone)
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self) -> 'SummaryCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or prune a WARC summary cache')
+    parser.add_argument('command', choices=['stats', 'prune'])
+    parser.add_argument('cache', help='Path to the SQLite summary cache')
+    args = parser.parse_args()
+
+    with SummaryCache(args.cache) as cache:
+        if args.command == 'prune':
+            print(f"Removed entries of {cache.prune()} missing files")
+        for kind, files in cache.conn.execute('SELECT kind, COUNT(*) FROM summaries GROUP BY kind ORDER BY kind'):
+            print(f"{kind:<14} {files:>10} files")
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""wayback_replay_server.py
+
+Local stand-in for the Wayback Machine CDX API and playback pages, so the
+network scripts (`ia_stats_fetcher.py`,
+`nick-com-helpers/fill_nick_msgboards_your_world.py`) can be tested and
+benchmarked without touching the live service.
+
+The server replays:
+
+- CDX rows from recorded CDX JSON responses (`output=json`, as saved from
+  `https://web.archive.org/cdx/search/cdx?url=...&output=json`) at
+  `/cdx/search/cdx`. Supported parameters: `url` (with a trailing `*` or
+  `matchType=prefix` for prefix queries), `fl`, `collapse` (whole field),
+  `limit`, `showResumeKey`/`resumeKey` and `output=json`.
+- Playback pages from a JSON object mapping request paths (e.g.
+  `/web/20040101000000/http://www.nick.com/...`) to HTML. Any other path is
+  answered with the "Url has never been harvested: <url>" stub.
+
+Latency, injected 503 errors, a global request rate limit and a cap on
+concurrent requests can be configured; requests over the limits get a 429
+with `Retry-After`. Without recordings, `--synthetic` serves a generated
+archive (see `synthetic_archive()`).
+
+Usage:
+    python wayback_replay_server.py --cdx site_a.json --cdx site_b.json --pages pages.json --port 8080
+    python wayback_replay_server.py --synthetic --latency 0.2 --error-rate 0.05 --rate-limit 20
+    python ia_stats_fetcher.py urls.csv out.csv --cdx-api http://127.0.0.1:8080/cdx/search/cdx
+"""
+
+from __future__ import annotations
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from cdxj_index import surt_key
+
+CDX_PATH = '/cdx/search/cdx'
+CDX_FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length']
+NEVER_HARVESTED_MARKER = 'Url has never been harvested:'
+
+
+class ReplayArchive:
+    """Recorded CDX rows (sorted by urlkey and timestamp) and playback pages."""
+
+    def __init__(self) -> None:
+        self.rows: List[Dict[str, str]] = []
+        self.keys: List[Tuple[str, str]] = []
+        self.pages: Dict[str, str] = {}
+
+    def add_rows(self, rows: Iterable[Dict[str, str]]) -> None:
+        for row in rows:
+            row = {field: str(row.get(field, '-')) for field in CDX_FIELDS}
+            if row['urlkey'] == '-':
+                row['urlkey'] = surt_key(row['original'])
+            self.rows.append(row)
+        self.rows.sort(key=lambda r: (r['urlkey'], r['timestamp']))
+        self.keys = [(r['urlkey'], r['timestamp']) for r in self.rows]
+
+    def load_cdx(self, path: str) -> int:
+        """Add the rows of a recorded CDX JSON response; returns the number of rows."""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        header, rows = data[0], [row for row in data[1:] if len(row) == len(data[0])]
+        self.add_rows(dict(zip(header, row)) for row in rows)
+        return len(rows)
+
+    def load_pages(self, path: str) -> int:
+        with open(path, encoding='utf-8') as f:
+            self.pages.update(json.load(f))
+        return len(self.pages)
+
+    def span(self, url: str, match_type: str) -> Tuple[int, int]:
+        """Return the `[start, end)` row range matching a CDX `url` query."""
+        if url.endswith('*'):
+            url, match_type = url[:-1], 'prefix'
+        if '://' not in url:
+            url = 'http://' + url
+        key = surt_key(url)
+        start = bisect.bisect_left(self.keys, (key, ''))
+        if match_type == 'prefix':
+            end = bisect.bisect_left(self.keys, (key + '\uffff', ''), lo=start)
+        else:
+            end = bisect.bisect_right(self.keys, (key, '\uffff'), lo=start)
+        return start, end
+
+
+def synthetic_archive(sites: int = 20, captures: int = 2000, boards: int = 20, threads: int = 5,
+                      seed: int = 0) -> Tuple[ReplayArchive, List[str], List[str]]:
+    """Generate a replay archive; returns `(archive, site URLs, board URLs)`.
+
+    Site `i` has `captures * (i % 3 + 1)` CDX rows (some adjacent rows share
+    a digest, as collapse=digest expects). Every fifth board was never
+    harvested, the next one has only never-harvested threads, and the others
+    only have content in their last thread, so every thread is probed.
+    Board URLs are playback paths; prefix them with the server address.
+    """
+    rng = random.Random(seed)
+    mimes = ['text/html'] * 6 + ['image/jpeg'] * 2 + ['image/png', 'text/css', 'application/javascript', 'application/pdf']
+    statuses = ['200'] * 8 + ['301', '302', '404', '-']
+    archive = ReplayArchive()
+    site_urls = []
+    rows = []
+    for i in range(sites):
+        site = f'http://site{i}.example'
+        site_urls.append(site)
+        for j in range(captures * (i % 3 + 1)):
+            path = f'/page{j // 4}.html'
+            digest = f'D{i}x{j // 2 if j % 7 == 0 else j}'
+            rows.append({'urlkey': surt_key(site + path), 'timestamp': f'{rng.randint(1998, 2024)}0101000000',
+                         'original': site + path, 'mimetype': rng.choice(mimes), 'statuscode': rng.choice(statuses),
+                         'digest': digest, 'length': str(rng.randint(200, 50000))})
+    archive.add_rows(rows)
+
+    board_urls = []
+    base = 'http://www.nick.com/blab/messageboards'
+    for b in range(boards):
+        board_path = f'/web/20040101000000/{base}/viewboard.jhtml?boardId={b}'
+        board_urls.append(board_path)
+        if b % 5 == 0:
+            continue
+        thread_paths = [f'/web/20040101000000/{base}/viewthread.jhtml?threadId={b * 100 + t}' for t in range(threads)]
+        links = ''.join(f'<li><a href="{path}">Thread {t}</a></li>' for t, path in enumerate(thread_paths))
+        archive.pages[board_path] = f'<html><body><h1>Board {b}</h1><ul>{links}</ul></body></html>'
+        if b % 5 != 1:
+            archive.pages[thread_paths[-1]] = f'<html><body><p>Posts of board {b}</p></body></html>'
+    return archive, site_urls, board_urls
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Threaded keep-alive HTTP server with injectable latency, errors and limits."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], archive: ReplayArchive, latency: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, max_concurrent: int = 0,
+                 seed: Optional[int] = None) -> None:
+        super().__init__(address, ReplayHandler)
+        self.archive = archive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_concurrent = max_concurrent
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = float(max(1.0, rate_limit))
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.connections = 0
+        self.statuses: Counter = Counter()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def admit(self) -> Optional[int]:
+        """Account for a new request; returns the error status to answer with, if any."""
+        with self.lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                return 429
+            if self.rate_limit > 0:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate_limit), self.tokens + (now - self.updated) * self.rate_limit)
+                self.updated = now
+                if self.tokens < 1:
+                    return 429
+                self.tokens -= 1
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return 503
+            self.in_flight += 1
+            return None
+
+    def delay(self) -> None:
+        if self.latency > 0:
+            with self.lock:
+                jitter = self.rng.uniform(0.5, 1.5)
+            time.sleep(self.latency * jitter)
+
+    def done(self, status: int, admitted: bool) -> None:
+        with self.lock:
+            self.statuses[status] += 1
+            if admitted:
+                self.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            return {'requests': sum(self.statuses.values()), 'connections': self.connections,
+                    'statuses': dict(self.statuses)}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's algorithm
+    # and the client's delayed ACK add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+    server: ReplayServer
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send_body(self, status: int, body: str, content_type: str = 'text/plain; charset=utf-8',
+                  headers: Optional[Dict[str, str]] = None) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        error = self.server.admit()
+        if error is not None:
+            self.server.delay()
+            self.send_body(error, f'{error}\n', headers={'Retry-After': '1'} if error == 429 else None)
+            self.server.done(error, admitted=False)
+            return
+        self.server.delay()
+        try:
+            if urlsplit(self.path).path == CDX_PATH:
+                status, body, content_type = self.cdx()
+            else:
+                status, body, content_type = self.playback()
+        except ValueError as e:
+            status, body, content_type = 400, f'{e}\n', 'text/plain; charset=utf-8'
+        try:
+            self.send_body(status, body, content_type)
+        finally:
+            self.server.done(status, admitted=True)
+
+    def cdx(self) -> Tuple[int, str, str]:
+        query = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        if 'url' not in query:
+            return 400, 'Missing url parameter\n', 'text/plain; charset=utf-8'
+        archive = self.server.archive
+        fields = query.get('fl', ','.join(CDX_FIELDS)).split(',')
+        if any(field not in CDX_FIELDS for field in fields):
+            return 400, f'Unknown field in fl={query["fl"]}\n', 'text/plain; charset=utf-8'
+        start, end = archive.span(query['url'], query.get('matchType', 'exact'))
+        limit = int(query.get('limit', 0) or 0)
+        collapse = query.get('collapse')
+        position = max(start, int(query.get('resumeKey', start)))
+
+        rows = []
+        while position < end and (not limit or len(rows) < limit):
+            row = archive.rows[position]
+            # Collapsing compares with the row before, also across pages
+            if not (collapse and position > start and archive.rows[position - 1][collapse] == row[collapse]):
+                rows.append([row[field] for field in fields])
+            position += 1
+        resume_key = str(position) if query.get('showResumeKey') == 'true' and position < end else None
+
+        if query.get('output') == 'json':
+            data = ([fields] + rows if rows else []) + ([[], [resume_key]] if resume_key else [])
+            return 200, json.dumps(data), 'application/json'
+        body = ''.join(' '.join(row) + '\n' for row in rows)
+        if resume_key:
+            body += f'\n{resume_key}\n'
+        return 200, body, 'text/plain; charset=utf-8'
+
+    def playback(self) -> Tuple[int, str, str]:
+        page = self.server.archive.pages.get(self.path)
+        if page is None:
+            return 200, f'{NEVER_HARVESTED_MARKER} {self.path}\n', 'text/plain; charset=utf-8'
+        return 200, page, 'text/html; charset=utf-8'
+
+
+def start_server(archive: ReplayArchive, host: str = '127.0.0.1', port: int = 0, **options) -> ReplayServer:
+    """Start a `ReplayServer` in a background thread (port 0 picks a free port)."""
+    server = ReplayServer((host, port), archive, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cdx', action='append', default=[], metavar='FILE',
+                        help='Recorded CDX JSON response to replay (repeatable)')
+    parser.add_argument('--pages', metavar='FILE', help='JSON object mapping playback paths to HTML')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Mean seconds added to every response, jittered by +-50%% (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 503 (default: 0)')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='Requests per second served; the excess gets 429 (default: unlimited)')
+    parser.add_argument('--max-concurrent', type=int, default=0,
+                        help='Concurrent requests served; the excess gets 429 (default: unlimited)')
+    parser.add_argument('--seed', type=int, help='Seed for latency jitter and error injection')
+
+
+def server_options(args: argparse.Namespace) -> Dict[str, object]:
+    return {'latency': args.latency, 'error_rate': args.error_rate, 'rate_limit': args.rate_limit,
+            'max_concurrent': args.max_concurrent, 'seed': args.seed}
+
+
+def load_archive(args: argparse.Namespace) -> ReplayArchive:
+    archive = ReplayArchive()
+    for path in args.cdx:
+        print(f"Loaded {archive.load_cdx(path)} CDX rows from {path}")
+    if args.pages:
+        print(f"Loaded {archive.load_pages(args.pages)} playback pages from {args.pages}")
+    return archive
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay recorded CDX responses and playback pages over local HTTP')
+    add_server_arguments(parser)
+    parser.add_argument('--synthetic', action='store_true', help='Serve a generated archive instead of recordings')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        archive, sites, boards = synthetic_archive()
+        print(f"Synthetic archive: {len(archive.rows)} CDX rows for {len(sites)} sites, {len(boards)} boards")
+    else:
+        archive = load_archive(args)
+    server = ReplayServer((args.host, args.port), archive, **server_options(args))
+    print(f"Serving on {server.url} (CDX API at {server.url}{CDX_PATH})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {server.snapshot()}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())